@@ -169,6 +169,7 @@ def detect(args):
         "alignments=%s" % args.alignments,
         "assembly_window_size=%s" % args.assembly_window_size,
         "assembly_window_slide=%s" % args.assembly_window_slide,
+        "assembly_redundancy_fraction=%s" % args.assembly_redundancy_fraction,
         "min_length=%s" % args.min_length,
         "min_support=%s" % args.min_support,
         "max_support=%s" % args.max_support,
@@ -186,6 +187,23 @@ def detect(args):
 
     return _run_snake_target(args, *command)
 
+def _get_total_assembly_cost(regions):
+    """
+    Return the total estimated cost of assembling the given BED file of regions
+    from the last column written by assembly_cost.py or the total length of
+    regions without estimated costs.
+    """
+    total_cost = 0
+    with open(regions, "r") as fh:
+        for line in fh:
+            fields = line.rstrip().split("\t")
+            if len(fields) >= 6:
+                total_cost += float(fields[5])
+            else:
+                total_cost += int(fields[2]) - int(fields[1])
+
+    return total_cost
+
 def assemble(args):
     """
     Assemble candidate regions from raw reads aligned to regions.
@@ -202,10 +220,26 @@ def assemble(args):
         "tmp_dir=%s" % args.tmpdir,
         "alignment_parameters=\"%s\"" % args.alignment_parameters,
         "mapping_quality=\"%s\"" % args.mapping_quality,
-        "minutes_to_delay_jobs=\"%s\"" % args.minutes_to_delay_jobs,
-        "assembly_log=\"%s\"" % args.assembly_log
+        "max_concurrent_readers=%s" % args.max_concurrent_readers,
+        "max_read_bytes_per_second=%s" % args.max_read_bytes_per_second,
+        "max_assembly_read_coverage=%s" % args.max_assembly_read_coverage,
+        "downsample_seed=%s" % args.downsample_seed,
+        "prescreen_min_evidence_reads=%s" % args.prescreen_min_evidence_reads,
+        "assembly_log=\"%s\"" % args.assembly_log,
+        "assembly_bundle_size=%s" % args.assembly_bundle_size,
+        "assembly_timeout_scale=%s" % args.assembly_timeout_scale,
+        "retry_timeout_scale=%s" % args.retry_timeout_scale
     )
 
+    if args.assembly_bundle_bases:
+        base_command = base_command + ("assembly_bundle_bases=%s" % args.assembly_bundle_bases,)
+
+    if args.assembly_cache:
+        base_command = base_command + (
+            "assembly_cache=%s" % args.assembly_cache,
+            "assembly_cache_max_gb=%s" % args.assembly_cache_max_gb
+        )
+
     if args.candidates:
         # For each contig/chromosome in the candidates file, submit a separate
         # Snakemake command. To do so, first split regions to assemble into one
@@ -244,6 +278,24 @@ def assemble(args):
         if rebuild_regions_by_contig:
             contig_file.close()
 
+            # Estimate the assembly cost of each region and sort regions in each
+            # contig by decreasing cost so the most expensive assemblies start
+            # first.
+            for contig in contigs:
+                contig_regions = os.path.join(tmpdir, "%s.bed" % contig)
+                command = ["python", os.path.join(INSTALL_DIR, "scripts", "assembly_cost.py"), "estimate", args.alignments, contig_regions, contig_regions]
+                if args.assembly_cost_model:
+                    command.extend(["--model", args.assembly_cost_model])
+
+                return_code = _run_cmd(command)
+                if return_code != 0:
+                    sys.stderr.write("Failed to estimate assembly costs for %s\n" % contig)
+                    return return_code
+
+        # Assemble contigs with the most total estimated cost first.
+        if not args.dryrun:
+            contigs = sorted(contigs, key=lambda contig: -_get_total_assembly_cost(os.path.join(tmpdir, "%s.bed" % contig)))
+
         # Assemble regions per contig creating a single merged BAM for each contig.
         local_assembly_basename = os.path.basename(args.assembly_alignments)
         local_assemblies = set()
@@ -436,6 +488,7 @@ if __name__ == "__main__":
     parser_detector.add_argument("--exclude", help="BED file of regions to exclude from local assembly (e.g., heterochromatic sequences, etc.)")
     parser_detector.add_argument("--assembly_window_size", type=int, help="size of reference window for local assemblies", default=60000)
     parser_detector.add_argument("--assembly_window_slide", type=int, help="size of reference window slide for local assemblies", default=20000)
+    parser_detector.add_argument("--assembly_redundancy_fraction", type=float, help="minimum fraction of an assembly region covered by another region to skip assembling it", default=1.0)
     parser_detector.add_argument("--min_length", type=int, help="minimum length required for SV candidates", default=50)
     parser_detector.add_argument("--min_support", type=int, help="minimum number of supporting reads required to flag a region as an SV candidate", default=5)
     parser_detector.add_argument("--max_support", type=int, help="maximum number of supporting reads allowed to flag a region as an SV candidate", default=100)
@@ -455,8 +508,19 @@ if __name__ == "__main__":
     parser_assembler.add_argument("--rebuild_regions", action="store_true", help="rebuild subset of regions to assemble")
     parser_assembler.add_argument("--alignment_parameters", help="BLASR parameters to use to align local assemblies", default="-affineAlign -affineOpen 8 -affineExtend 0 -bestn 1 -maxMatch 30 -sdpTupleSize 13")
     parser_assembler.add_argument("--mapping_quality", type=int, help="minimum mapping quality of raw reads to use for local assembly", default=30)
-    parser_assembler.add_argument("--minutes_to_delay_jobs", type=int, help="maximum number of minutes to delay local assembly jobs to limit simultaneous I/O on shared storage", default=1)
+    parser_assembler.add_argument("--max_concurrent_readers", type=int, help="maximum number of local assembly jobs reading raw read alignments at once to limit simultaneous I/O on shared storage (0 for no limit)", default=0)
+    parser_assembler.add_argument("--max_read_bytes_per_second", type=int, help="maximum bytes per second read from raw read alignments by all local assembly jobs (0 for no limit)", default=0)
+    parser_assembler.add_argument("--max_assembly_read_coverage", type=float, help="maximum total bases of reads used to assemble a region as a multiple of the region's length, keeping the longest reads with the highest mapping quality (0 to use all reads)", default=0)
+    parser_assembler.add_argument("--downsample_seed", type=int, help="random seed to break ties between equally preferred reads when downsampling reads for local assembly", default=1)
+    parser_assembler.add_argument("--prescreen_min_evidence_reads", type=int, help="minimum number of reads with large indels or clipped ends required to assemble a tiled window that does not cover an SV candidate (0 to assemble all windows)", default=0)
     parser_assembler.add_argument("--assembly_log", help="name of log file for local assemblies", default="assembly.log")
+    parser_assembler.add_argument("--assembly_bundle_size", type=int, help="number of regions to assemble back to back in each local assembly job", default=1)
+    parser_assembler.add_argument("--assembly_bundle_bases", type=int, help="total bases of regions to assemble back to back in each local assembly job (overrides --assembly_bundle_size)")
+    parser_assembler.add_argument("--assembly_cache", help="directory of cached local assemblies to reuse for regions with identical reads and parameters")
+    parser_assembler.add_argument("--assembly_cache_max_gb", type=float, help="maximum size of the local assembly cache in gigabytes", default=10)
+    parser_assembler.add_argument("--assembly_timeout_scale", type=float, help="multiplier for the time allowed for each local assembly based on its length and number of reads", default=1.0)
+    parser_assembler.add_argument("--retry_timeout_scale", type=float, help="multiplier for the time allowed when retrying local assemblies that timed out", default=4.0)
+    parser_assembler.add_argument("--assembly_cost_model", help="JSON file of assembly cost model coefficients fit by scripts/assembly_cost.py from recorded assembly runtimes")
     parser_assembler.set_defaults(func=assemble)
 
     # Call SVs and indels from BLASR alignments of local assemblies.
@@ -483,6 +547,7 @@ if __name__ == "__main__":
     parser_runner.add_argument("--exclude", help="BED file of regions to exclude from local assembly (e.g., heterochromatic sequences, etc.)")
     parser_runner.add_argument("--assembly_window_size", type=int, help="size of reference window for local assemblies", default=60000)
     parser_runner.add_argument("--assembly_window_slide", type=int, help="size of reference window slide for local assemblies", default=30000)
+    parser_runner.add_argument("--assembly_redundancy_fraction", type=float, help="minimum fraction of an assembly region covered by another region to skip assembling it", default=1.0)
     parser_runner.add_argument("--min_length", type=int, help="minimum length required for SV candidates", default=50)
     parser_runner.add_argument("--min_support", type=int, help="minimum number of supporting reads required to flag a region as an SV candidate", default=5)
     parser_runner.add_argument("--max_support", type=int, help="maximum number of supporting reads allowed to flag a region as an SV candidate", default=100)
@@ -495,8 +560,19 @@ if __name__ == "__main__":
     parser_runner.add_argument("--runjobs", help="A comma-separated list of jobs for each step: align, detect, assemble, and call (in that order). A missing number uses the value set by --jobs (or 1 if --jobs was not set).", default="")
     parser_runner.add_argument("--alignment_parameters", help="BLASR parameters to use to align raw reads", default="-bestn 2 -maxAnchorsPerPosition 100 -advanceExactMatches 10 -affineAlign -affineOpen 100 -affineExtend 0 -insertion 5 -deletion 5 -extend -maxExtendDropoff 50")
     parser_runner.add_argument("--mapping_quality", type=int, help="minimum mapping quality of raw reads to use for local assembly", default=30)
-    parser_runner.add_argument("--minutes_to_delay_jobs", type=int, help="maximum number of minutes to delay local assembly jobs to limit simultaneous I/O on shared storage", default=1)
+    parser_runner.add_argument("--max_concurrent_readers", type=int, help="maximum number of local assembly jobs reading raw read alignments at once to limit simultaneous I/O on shared storage (0 for no limit)", default=0)
+    parser_runner.add_argument("--max_read_bytes_per_second", type=int, help="maximum bytes per second read from raw read alignments by all local assembly jobs (0 for no limit)", default=0)
+    parser_runner.add_argument("--max_assembly_read_coverage", type=float, help="maximum total bases of reads used to assemble a region as a multiple of the region's length, keeping the longest reads with the highest mapping quality (0 to use all reads)", default=0)
+    parser_runner.add_argument("--downsample_seed", type=int, help="random seed to break ties between equally preferred reads when downsampling reads for local assembly", default=1)
+    parser_runner.add_argument("--prescreen_min_evidence_reads", type=int, help="minimum number of reads with large indels or clipped ends required to assemble a tiled window that does not cover an SV candidate (0 to assemble all windows)", default=0)
     parser_runner.add_argument("--assembly_log", help="name of log file for local assemblies", default="assembly.log")
+    parser_runner.add_argument("--assembly_bundle_size", type=int, help="number of regions to assemble back to back in each local assembly job", default=1)
+    parser_runner.add_argument("--assembly_bundle_bases", type=int, help="total bases of regions to assemble back to back in each local assembly job (overrides --assembly_bundle_size)")
+    parser_runner.add_argument("--assembly_cache", help="directory of cached local assemblies to reuse for regions with identical reads and parameters")
+    parser_runner.add_argument("--assembly_cache_max_gb", type=float, help="maximum size of the local assembly cache in gigabytes", default=10)
+    parser_runner.add_argument("--assembly_timeout_scale", type=float, help="multiplier for the time allowed for each local assembly based on its length and number of reads", default=1.0)
+    parser_runner.add_argument("--retry_timeout_scale", type=float, help="multiplier for the time allowed when retrying local assemblies that timed out", default=4.0)
+    parser_runner.add_argument("--assembly_cost_model", help="JSON file of assembly cost model coefficients fit by scripts/assembly_cost.py from recorded assembly runtimes")
     parser_runner.add_argument("--min_hardstop_support", type=int, help="minimum number of reads with hardstops required to flag a region as an SV candidate", default=11)
     parser_runner.add_argument("--max_candidate_length", type=int, help="maximum length allowed for an SV candidate region", default=60000)
     parser_runner.set_defaults(func=run)
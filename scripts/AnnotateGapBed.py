@@ -1,75 +1,216 @@
 #!/usr/bin/env python
-
+"""
+Annotate gap BED records with RepeatMasker annotations and the fraction of
+masked bases in each record's sequence.
+
+Records, RepeatMasker annotations, and masked sequences are joined by the
+`chr/start/end` names given to sequences by GapBedToFasta.py. Masked sequences
+are read by random access through an index of sequence offsets in the masked
+FASTA, and annotations are read from the `.out` file as records are annotated,
+so only the annotations of sequences read ahead of the current record are kept
+in memory when annotations are listed in the order of the masked sequences.
+"""
 import sys
 import argparse
-from Bio import SeqIO
-from Bio import Seq
-from Bio import SeqRecord
 
-if (len(sys.argv) < 3):
-    print "usage: AnnotateGapBed.py bedIn bedOut annotation.out"
-    sys.exit(0)
+# Lowercase (masked) bases removed to count masked bases.
+MASKED_BASES = b"acgt"
 
-ap = argparse.ArgumentParser(description="Print gap sequences to fasta files.")
-ap.add_argument("bedin", help="Input bed file.")
-ap.add_argument("bedout", help="Output bed file.")
-ap.add_argument("dotout", help="RepeatMasker file.out annotation file.")
-ap.add_argument("maskedout", help="Masked output file.", default=None)
-ap.add_argument("--seqidx", help="Index of gap sequence (6)", default=6, type=int)
-args = ap.parse_args()
-bedFileIn = open(args.bedin, 'r')
-bedFileOut = open(args.bedout, 'w')
 
-annotations = {}
+def index_fasta(fasta_filename):
+    """
+    Return a dictionary of (ordinal, start offset, end offset) of each
+    sequence's lines by sequence name in the given FASTA file.
+    """
+    index = {}
+    name = None
+    offset = 0
+    with open(fasta_filename, "rb") as fh:
+        for line in fh:
+            if line.startswith(b">"):
+                if name is not None:
+                    index[name] = (len(index), start, offset)
 
-dotoutFile = open(args.dotout, 'r')
-maskedDict = {}
+                name = line[1:].split()[0].decode() if len(line[1:].split()) > 0 else ""
+                if name in index:
+                    raise ValueError("Duplicate key '%s'" % name)
 
-if (args.maskedout is not None):
-    maskedSequences = open(args.maskedout)
-    maskedDict = SeqIO.to_dict(SeqIO.parse(maskedSequences, "fasta"))
+                start = offset + len(line)
 
+            offset += len(line)
 
-for i in range(3):
-    dotoutFile.readline()
+    if name is not None:
+        index[name] = (len(index), start, offset)
 
-for line in dotoutFile:
-    vals = line.split()
-    name = vals[4]
-    rep  = vals[9]
-    pre  = vals[11]
-    post = vals[13]
-    pre = int(pre.replace("(","").replace(")",""))
-    post = int(post.replace("(","").replace(")",""))
+    return index
 
-    if (pre+post < 30):
-        rep = rep + ":FULL"
-    else:
-        rep = rep + ":INC"
 
-    if (name not in annotations):
-        annotations[name] = []
-    annotations[name].append(rep)
+def read_sequence(fh, index, name):
+    """
+    Return the sequence of the given name as bytes from the given open FASTA
+    file and its index.
+    """
+    ordinal, start, end = index[name]
+    fh.seek(start)
+    return b"".join(fh.read(end - start).split())
 
 
-for line in bedFileIn:
-    vals = line.split()
-    name = '/'.join(vals[0:3])
-    if (name in annotations):
-        annotation = ';'.join(annotations[name])
-    else:
-        annotation = "NONE"
+def get_masked_fraction(sequence):
+    """
+    Return the fraction of masked (lowercase) bases in the given sequence.
 
-    repeatContent = ""
-    if (name in maskedDict):
-        vals[5] =  str(maskedDict[name].seq)
-        repeatContent = "\t{:2.2f}".format(float(vals[5].count("a") + vals[5].count("c") + vals[5].count("g") + vals[5].count("t"))/len(vals[5]))
+    >>> get_masked_fraction(b"acGTnN")
+    0.3333333333333333
+    """
+    return float(len(sequence) - len(sequence.translate(None, MASKED_BASES))) / len(sequence)
 
-    line = '\t'.join(vals[0:args.seqidx]) + '\t' + annotation + '\t' + '\t'.join(vals[args.seqidx:]) + repeatContent + '\n'
 
-    bedFileOut.write(line)
-
-
-bedFileOut.close()
+def parse_annotation(line):
+    """
+    Return the sequence name and annotation of the given RepeatMasker `.out`
+    line with the repeat marked as full-length or incomplete.
+    """
+    vals = line.split()
+    name = vals[4]
+    rep = vals[9]
+    pre = int(vals[11].replace("(", "").replace(")", ""))
+    post = int(vals[13].replace("(", "").replace(")", ""))
 
+    if (pre + post < 30):
+        rep = rep + ":FULL"
+    else:
+        rep = rep + ":INC"
 
+    return name, rep
+
+
+def read_annotation_lines(out_filename):
+    """
+    Yield the annotation lines of the given RepeatMasker `.out` file after its
+    three header lines.
+    """
+    with open(out_filename, "r") as fh:
+        for i in range(3):
+            fh.readline()
+
+        for line in fh:
+            yield line
+
+
+def is_in_fasta_order(out_filename, fasta_index):
+    """
+    Return True if all annotations in the given `.out` file are for sequences in
+    the given FASTA index and are listed in the order of the sequences.
+    """
+    last_ordinal = -1
+    for line in read_annotation_lines(out_filename):
+        name = line.split()[4]
+        if name not in fasta_index or fasta_index[name][0] < last_ordinal:
+            return False
+
+        last_ordinal = fasta_index[name][0]
+
+    return True
+
+
+class RepeatAnnotations(object):
+    """
+    Return RepeatMasker annotations per sequence from a `.out` file.
+
+    When annotations are listed in the order of sequences in the masked FASTA,
+    annotations are read as sequences are requested and only annotations of
+    sequences read ahead of the requested sequence are kept in memory.
+    Otherwise, all annotations are loaded at once.
+    """
+    def __init__(self, out_filename, fasta_index):
+        self.fasta_index = fasta_index
+        self.pending = {}
+        self.last_name = None
+        self.last_reps = []
+        self.lines = read_annotation_lines(out_filename)
+        self.last_ordinal = -1
+        self.ordered = is_in_fasta_order(out_filename, fasta_index)
+
+        if not self.ordered:
+            for line in self.lines:
+                name, rep = parse_annotation(line)
+                self.pending.setdefault(name, []).append(rep)
+
+            self.lines = None
+
+    def pop(self, name):
+        """
+        Return the list of annotations for the given sequence name. Annotations
+        of earlier requested sequences other than the last one are removed from
+        memory when the annotations are read in order.
+        """
+        if not self.ordered:
+            return self.pending.get(name, [])
+
+        if name == self.last_name:
+            return self.last_reps
+
+        if name in self.fasta_index:
+            ordinal = self.fasta_index[name][0]
+            while self.lines is not None and self.last_ordinal <= ordinal:
+                try:
+                    line = next(self.lines)
+                except StopIteration:
+                    self.lines = None
+                    break
+
+                line_name, rep = parse_annotation(line)
+                self.pending.setdefault(line_name, []).append(rep)
+                self.last_ordinal = self.fasta_index[line_name][0]
+
+        self.last_name = name
+        self.last_reps = self.pending.pop(name, [])
+        return self.last_reps
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3):
+        sys.stdout.write("usage: AnnotateGapBed.py bedIn bedOut annotation.out\n")
+        sys.exit(0)
+
+    ap = argparse.ArgumentParser(description="Print gap sequences to fasta files.")
+    ap.add_argument("bedin", help="Input bed file.")
+    ap.add_argument("bedout", help="Output bed file.")
+    ap.add_argument("dotout", help="RepeatMasker file.out annotation file.")
+    ap.add_argument("maskedout", help="Masked output file.", default=None)
+    ap.add_argument("--seqidx", help="Index of gap sequence (6)", default=6, type=int)
+    args = ap.parse_args()
+    bedFileIn = open(args.bedin, 'r')
+    bedFileOut = open(args.bedout, 'w')
+
+    maskedIndex = {}
+    maskedFile = None
+    if (args.maskedout is not None):
+        maskedIndex = index_fasta(args.maskedout)
+        maskedFile = open(args.maskedout, 'rb')
+
+    annotations = RepeatAnnotations(args.dotout, maskedIndex)
+
+    for line in bedFileIn:
+        vals = line.split()
+        name = '/'.join(vals[0:3])
+        reps = annotations.pop(name)
+        if (len(reps) > 0):
+            annotation = ';'.join(reps)
+        else:
+            annotation = "NONE"
+
+        repeatContent = ""
+        if (name in maskedIndex):
+            sequence = read_sequence(maskedFile, maskedIndex, name)
+            vals[5] = sequence if isinstance(sequence, str) else sequence.decode()
+            repeatContent = "\t{:2.2f}".format(get_masked_fraction(sequence))
+
+        line = '\t'.join(vals[0:args.seqidx]) + '\t' + annotation + '\t' + '\t'.join(vals[args.seqidx:]) + repeatContent + '\n'
+
+        bedFileOut.write(line)
+
+    if (maskedFile is not None):
+        maskedFile.close()
+
+    bedFileOut.close()
@@ -1,57 +1,203 @@
 #!/usr/bin/env python
+"""
+Annotate a gap BED file with tandem repeats from a TRF table, lowercasing
+tandem repeat bases in each record's sequence and appending the total tandem
+repeat bases and the proportion of bases in tandem repeats.
 
+Overlapping TRF intervals of each sequence are merged once when they are read
+and applied to the sequence in a single pass. When sequences in the TRF table
+are listed in the order of the BED records, TRF intervals are read as records
+are annotated, so only intervals of sequences read ahead of the current record
+are kept in memory.
+"""
 import argparse
 import sys
-import intervaltree as itree
-
-ap = argparse.ArgumentParser(description="Annotate a gap bed file with an associated TRF table.")
-ap.add_argument("bed", help="Input BED file.")
-ap.add_argument("trf", help="Input TRF table file.")
-ap.add_argument("bed_out", help="Output BED file.")
-args = ap.parse_args()
-
-trfFile = open(args.trf, 'r')
-prevSeqName = ""
-
-annotations = {}
-for line in trfFile:
-    if (line[0] == '@'):
-        seqName = line[1:].strip()
-    else:
+
+
+def merge_intervals(intervals):
+    """
+    Return the given list of (start, end) intervals sorted with overlapping
+    intervals merged. Intervals that only touch are not merged.
+
+    >>> merge_intervals([(10, 20), (0, 5), (15, 30), (5, 8), (30, 31)])
+    [(0, 5), (5, 8), (10, 30), (30, 31)]
+    """
+    merged = []
+    for start, end in sorted(set(intervals)):
+        if len(merged) > 0 and start < merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def mask_tandem_repeats(sequence, intervals):
+    """
+    Return the given sequence with bases in the given merged intervals
+    lowercased and the total length of the intervals.
+
+    >>> mask_tandem_repeats("ACGTACGT", [(1, 3), (6, 10)])
+    ('AcgTACgt', 6)
+    """
+    masked = bytearray(sequence.encode("ascii"))
+    total = 0
+    for start, end in intervals:
+        total += end - start
+        masked[start:end] = masked[start:end].lower()
+
+    return str(masked.decode("ascii")), total
+
+
+def read_trf_blocks(trf_filename):
+    """
+    Yield the name and list of (start, end) intervals of each sequence block
+    in the given TRF table. Blocks without intervals are skipped.
+    """
+    seqName = None
+    intervals = []
+    with open(trf_filename, "r") as fh:
+        for line in fh:
+            if (line[0] == '@'):
+                if len(intervals) > 0:
+                    yield seqName, intervals
+
+                seqName = line[1:].strip()
+                intervals = []
+            else:
+                vals = line.split()
+                start, end = int(vals[0]), int(vals[1])
+                if end <= start:
+                    raise ValueError("Null interval %s-%s for %s" % (start, end, seqName))
+
+                intervals.append((start, end))
+
+    if len(intervals) > 0:
+        yield seqName, intervals
+
+
+def get_record_order(bed_filename):
+    """
+    Return a dictionary of the ordinal of each record name in the given BED file
+    or None if any name is listed more than once in non-consecutive records.
+    """
+    order = {}
+    previous = None
+    with open(bed_filename, "r") as fh:
+        for line in fh:
+            name = '/'.join(line.split()[0:3])
+            if name != previous:
+                if name in order:
+                    return None
+
+                order[name] = len(order)
+                previous = name
+
+    return order
+
+
+def is_in_record_order(trf_filename, order):
+    """
+    Return True if all sequences in the given TRF table are listed in the given
+    order of records.
+    """
+    if order is None:
+        return False
+
+    last_ordinal = -1
+    for seqName, intervals in read_trf_blocks(trf_filename):
+        if seqName not in order or order[seqName] < last_ordinal:
+            return False
+
+        last_ordinal = order[seqName]
+
+    return True
+
+
+class TandemRepeats(object):
+    """
+    Return merged TRF intervals per sequence from a TRF table, reading the
+    table as sequences are requested if it is in the order of the requests.
+    """
+    def __init__(self, trf_filename, order):
+        self.order = order
+        self.ordered = is_in_record_order(trf_filename, order)
+        self.blocks = read_trf_blocks(trf_filename)
+        self.pending = {}
+        self.last_ordinal = -1
+        self.last_name = None
+        self.last_intervals = None
+
+        if not self.ordered:
+            for seqName, intervals in self.blocks:
+                self.pending.setdefault(seqName, []).extend(intervals)
+
+            for seqName in self.pending:
+                self.pending[seqName] = merge_intervals(self.pending[seqName])
+
+            self.blocks = None
+
+    def get(self, name):
+        """
+        Return the merged intervals for the given sequence name or None if the
+        sequence has no tandem repeats.
+        """
+        if not self.ordered:
+            return self.pending.get(name)
+
+        if name == self.last_name:
+            return self.last_intervals
+
+        ordinal = self.order[name]
+        while self.blocks is not None and self.last_ordinal <= ordinal:
+            try:
+                seqName, intervals = next(self.blocks)
+            except StopIteration:
+                self.blocks = None
+                break
+
+            self.pending.setdefault(seqName, []).extend(intervals)
+            self.last_ordinal = self.order[seqName]
+
+        intervals = self.pending.pop(name, None)
+        if intervals is not None:
+            intervals = merge_intervals(intervals)
+
+        self.last_name = name
+        self.last_intervals = intervals
+        return intervals
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Annotate a gap bed file with an associated TRF table.")
+    ap.add_argument("bed", help="Input BED file.")
+    ap.add_argument("trf", help="Input TRF table file.")
+    ap.add_argument("bed_out", help="Output BED file.")
+    args = ap.parse_args()
+
+    annotations = TandemRepeats(args.trf, get_record_order(args.bed))
+    sys.stderr.write("done processing annotations\n")
+
+    bedFile = open(args.bed, 'r')
+    bedOutFile = open(args.bed_out, 'w')
+
+    for line in bedFile:
         vals = line.split()
-        if (seqName not in annotations):
-            annotations[seqName] = itree.IntervalTree()
-        annotations[seqName].addi(int(vals[0]), int(vals[1]))
-
-print "done processing annotations"
-
-bedFile = open(args.bed, 'r')
-bedOutFile = open(args.bed_out, 'w')
-
-for line in bedFile:
-    vals = line.split()
-    seqTitle = '/'.join(vals[0:3])
-    totalTR = 0
-    if (seqTitle in annotations):
-        seq = vals[5]
-        i = 0
-        annotations[seqTitle].merge_overlaps()
-        for intv in annotations[seqTitle]:
-            # Count total bases of tandem repeats annotated for this SV
-            # sequence.
-            totalTR += intv[1] - intv[0]
-
-            # Lowercase sequence annotated as a tandem repeat.
-            seq = seq[:intv[0]] + seq[intv[0]:intv[1]].lower() + seq[intv[1]:]
-
-        vals[5] = seq
-
-        # Annotate the input BED with total tandem repeat bases and the
-        # proportion of bases annotated as tandem repeats.
- 	vals.append(str(totalTR))
-	vals.append("{:2.2f}".format(float(totalTR)/len(seq)))
-    else:
-	vals.append("0")
-	vals.append("0")
-    bedOutFile.write('\t'.join(vals)  + "\n")
+        seqTitle = '/'.join(vals[0:3])
+        intervals = annotations.get(seqTitle)
+        if (intervals is not None):
+            # Lowercase sequence annotated as a tandem repeat and count total
+            # bases of tandem repeats annotated for this SV sequence.
+            seq, totalTR = mask_tandem_repeats(vals[5], intervals)
+            vals[5] = seq
+
+            # Annotate the input BED with total tandem repeat bases and the
+            # proportion of bases annotated as tandem repeats.
+            vals.append(str(totalTR))
+            vals.append("{:2.2f}".format(float(totalTR)/len(seq)))
+        else:
+            vals.append("0")
+            vals.append("0")
+        bedOutFile.write('\t'.join(vals) + "\n")
 
+    bedOutFile.close()
@@ -22,7 +22,7 @@ ap.add_argument("--tsd", help="Attempt to find Target Site Duplications at most
 ap.add_argument("--outsam", help="Write the modified condensed sam to a file.", default=None)
 ap.add_argument("--minq", help="Minimal mapping quality to consider (10)",default=10,type=int)
 ap.add_argument("--qpos", help="Write query position of gaps", default=False,action='store_true')
-ap.add_argument("--snv", help="Print SNVs to this file.", default=None)
+ap.add_argument("--snv", help="Print SNVs to this file with the start of their alignment in the last column.", default=None)
 ap.add_argument("--nloc", help="Print locations of aligned N's here.", default=None)
 ap.add_argument("--contigBed", help="Print where contigs map.", default=None)
 ap.add_argument("--status", help="Print how far along the alignments are.", default=False, action='store_true')
@@ -262,7 +262,7 @@ for samFileName in args.sam:
 
                         if (querySeq[mp].upper() != targetSeq[mp].upper() and targetSeq[mp].upper() != 'N' and querySeq[mp].upper() != 'N'):
                             nMis +=1
-                            snvOut.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(aln.tName, tPos+mp, tPos+mp+1, targetSeq[mp], querySeq[mp], aln.title, mp+qPos ))
+                            snvOut.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(aln.tName, tPos+mp, tPos+mp+1, targetSeq[mp], querySeq[mp], aln.title, mp+qPos, aln.tStart ))
                         if (args.nloc is not None and (targetSeq[mp].upper() == 'N' or querySeq[mp].upper() == 'N')):
                             nLocOut.write("{}\t{}\t{}\n".format(aln.tName, tPos+mp,tPos+mp+1));
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Aggregate SNVs printed by PrintGaps.py into one call per site with the allele
+supported by the most local assemblies.
+
+Alleles are counted per site and the allele with the highest count is reported
+for each site with ties broken by reference and alternate bases. Sites whose
+top allele is supported by only one assembly are dropped. Calls are written
+sorted by chromosome name and position as with `sort -k 1,1 -k 2,2n`.
+
+SNVs are read in the order of a coordinate-sorted alignment BAM with the start
+of each SNV's alignment in the eighth column. Alignments that start after a
+site cannot support it, so each site is aggregated and written as soon as an
+alignment starts past it. Only sites overlapped by the current alignments are
+kept in memory. Calls of each chromosome are written to a temporary file and
+the files are concatenated by chromosome name at the end.
+"""
+import argparse
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+
+
+def read_snvs(snvs_filename):
+    """
+    Yield the chromosome, start, end, reference base, alternate base, and
+    alignment start of each SNV in the given file.
+    """
+    with open(snvs_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 8:
+                continue
+
+            yield fields[0], int(fields[1]), int(fields[2]), fields[3], fields[4], int(fields[7])
+
+
+def get_top_allele(alleles):
+    """
+    Return the reference base, alternate base, and count of the allele with the
+    most support in the given dictionary of counts by (reference, alternate)
+    allele. Ties are broken by the lowest reference and alternate bases.
+
+    >>> get_top_allele({("A", "G"): 2, ("A", "C"): 2, ("A", "T"): 1})
+    ('A', 'C', 2)
+    """
+    (reference, alternate), count = min(alleles.items(), key=lambda item: (-item[1], item[0]))
+    return reference, alternate, count
+
+
+def aggregate_site(chromosome, site, alleles, min_support):
+    """
+    Return the output line for the given site and allele counts or None if the
+    top allele of the site has less than the given minimum support.
+    """
+    reference, alternate, count = get_top_allele(alleles)
+    if count < min_support:
+        return None
+
+    return "%s\t%i\t%i\t%s\t%s\t%i\n" % (chromosome, site[0], site[1], reference, alternate, count)
+
+
+def aggregate_snvs(snvs, min_support):
+    """
+    Yield the chromosome and output line of each site for the given iterable
+    of SNVs in alignment order. Lines of each chromosome are yielded in order
+    of position.
+
+    >>> snvs = [("chr1", 10, 11, "A", "G", 5), ("chr1", 12, 13, "C", "T", 5),
+    ...         ("chr1", 10, 11, "A", "G", 8), ("chr1", 12, 13, "C", "A", 12),
+    ...         ("chr2", 3, 4, "G", "T", 0), ("chr2", 3, 4, "G", "T", 1)]
+    >>> [line for chromosome, line in aggregate_snvs(snvs, 2)]
+    ['chr1\\t10\\t11\\tA\\tG\\t2\\n', 'chr2\\t3\\t4\\tG\\tT\\t2\\n']
+    """
+    chromosome = None
+    passed_chromosomes = set()
+    alignment_start = None
+    sites = {}
+    positions = []
+    for snv_chromosome, start, end, reference, alternate, snv_alignment_start in snvs:
+        if snv_chromosome != chromosome:
+            if snv_chromosome in passed_chromosomes:
+                raise ValueError("SNVs of %s are not contiguous; SNVs must be in the order of a coordinate-sorted BAM" % snv_chromosome)
+
+            # Sites of the previous chromosome cannot get more support.
+            while len(positions) > 0:
+                site = heapq.heappop(positions)
+                line = aggregate_site(chromosome, site, sites.pop(site), min_support)
+                if line is not None:
+                    yield chromosome, line
+
+            if chromosome is not None:
+                passed_chromosomes.add(chromosome)
+
+            chromosome = snv_chromosome
+            alignment_start = None
+
+        if alignment_start is not None and snv_alignment_start < alignment_start:
+            raise ValueError("Alignment at %s:%i starts before a previous alignment; SNVs must be in the order of a coordinate-sorted BAM" % (chromosome, snv_alignment_start))
+
+        # Alignments start at or after this one, so sites before its start
+        # have all of their support.
+        alignment_start = snv_alignment_start
+        while len(positions) > 0 and positions[0][0] < alignment_start:
+            site = heapq.heappop(positions)
+            line = aggregate_site(chromosome, site, sites.pop(site), min_support)
+            if line is not None:
+                yield chromosome, line
+
+        site = (start, end)
+        if site not in sites:
+            sites[site] = {}
+            heapq.heappush(positions, site)
+
+        allele = (reference, alternate)
+        sites[site][allele] = sites[site].get(allele, 0) + 1
+
+    while len(positions) > 0:
+        site = heapq.heappop(positions)
+        line = aggregate_site(chromosome, site, sites.pop(site), min_support)
+        if line is not None:
+            yield chromosome, line
+
+
+def write_calls(calls, output_filename):
+    """
+    Write the given iterable of (chromosome, line) tuples to the given output
+    file sorted by chromosome name and preserving the order of lines within
+    each chromosome.
+    """
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_filename)))
+    try:
+        chromosome_files = {}
+        oh = None
+        chromosome = None
+        for call_chromosome, line in calls:
+            if call_chromosome != chromosome:
+                if oh is not None:
+                    oh.close()
+
+                chromosome = call_chromosome
+                chromosome_files[chromosome] = os.path.join(tmp_dir, "%i.bed" % len(chromosome_files))
+                oh = open(chromosome_files[chromosome], "w")
+
+            oh.write(line)
+
+        if oh is not None:
+            oh.close()
+
+        with open(output_filename, "w") as oh:
+            for chromosome in sorted(chromosome_files):
+                with open(chromosome_files[chromosome], "r") as fh:
+                    shutil.copyfileobj(fh, oh)
+
+        sys.stderr.write("Aggregated SNVs on %i chromosomes\n" % len(chromosome_files))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snvs", help="SNVs from PrintGaps.py in the order of a coordinate-sorted BAM with chromosome, start, end, reference base, and alternate base as the first columns and alignment start as the eighth")
+    parser.add_argument("output", help="SNV calls with the top allele and its support per site")
+    parser.add_argument("--min_support", type=int, default=2, help="minimum number of assemblies supporting the top allele of a site")
+    args = parser.parse_args()
+
+    write_calls(aggregate_snvs(read_snvs(args.snvs), args.min_support), args.output)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Annotate indels with support from assembled contigs, assembled contig depth,
+and read coverage in a single sweep over sorted tracks.
+
+Each indel line is written with its first five columns, the number of
+assembled contigs supporting the indel, the maximum depth of assembled contigs
+overlapping the indel, the mean read coverage overlapping the indel, and the
+indel type. Indels without overlapping depth or coverage records have values
+of zero as with `bedtools intersect -loj` followed by `bedtools groupby`.
+Optionally, the name of the first short tandem repeat (STR) overlapping each
+indel or 0 is added before the indel type.
+
+Tracks must be sorted by chromosome and start position with chromosomes in the
+same order as the indels. Indels are visited in order of start position within
+each chromosome and lines are written in their input order.
+"""
+import argparse
+
+
+def read_track(track_filename):
+    """
+    Yield the chromosome, start, end, and fourth column value of each record in
+    the given BED file.
+    """
+    with open(track_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t", 4)
+            if len(fields) < 4:
+                continue
+
+            yield fields[0], int(fields[1]), int(fields[2]), fields[3]
+
+
+class TrackSweep(object):
+    """
+    Return records of a sorted BED track overlapping regions requested in order
+    of chromosome and start position, reading the track once. Chromosomes are
+    requested in the given order and chromosomes without records in the track
+    have no overlaps.
+
+    >>> records = [("chr1", 0, 10, "1"), ("chr3", 0, 10, "3"), ("chr4", 0, 10, "4")]
+    >>> sweep = TrackSweep(records, ["chr1", "chr2", "chr3"], "coverage.bed")
+    >>> [sweep.overlaps(chromosome, 5, 6) for chromosome in ("chr1", "chr2", "chr3")]
+    [['1'], [], ['3']]
+    """
+    def __init__(self, records, chromosomes, name):
+        self.name = name
+        self.records = iter(records)
+        self.next_record = next(self.records, None)
+        self.chromosomes = set(chromosomes)
+        self.chromosome = None
+        self.passed_chromosomes = set()
+        self.active = []
+
+    def overlaps(self, chromosome, start, end):
+        """
+        Return the list of values of records overlapping the given region in
+        the order of the track.
+        """
+        if chromosome != self.chromosome:
+            if self.chromosome is not None:
+                self.passed_chromosomes.add(self.chromosome)
+
+            # Skip the remaining records of the previous chromosome and records
+            # of chromosomes without indels. Records of a later chromosome with
+            # indels stay in place until that chromosome is requested.
+            while self.next_record is not None and self.next_record[0] != chromosome:
+                if self.next_record[0] in self.chromosomes and self.next_record[0] not in self.passed_chromosomes:
+                    break
+
+                if self.next_record[0] != self.chromosome and self.next_record[0] in self.passed_chromosomes:
+                    raise ValueError("Chromosome %s of %s is not in the same order as the indels" % (self.next_record[0], self.name))
+
+                self.next_record = next(self.records, None)
+
+            self.chromosome = chromosome
+            self.active = []
+
+        # Records that end before this region also end before all later regions
+        # of this chromosome.
+        self.active = [record for record in self.active if record[1] > start]
+
+        while self.next_record is not None and self.next_record[0] == chromosome and self.next_record[1] < end:
+            if self.next_record[2] > start:
+                self.active.append(self.next_record[1:])
+            self.next_record = next(self.records, None)
+
+        return [value for record_start, record_end, value in self.active if record_start < end]
+
+
+def get_number(value):
+    """
+    Return the given track value as a number with missing values as zero.
+    """
+    if value == ".":
+        return 0.0
+
+    return float(value)
+
+
+def annotate_indels(indels_filename, read_coverage_filename, contig_depth_filename, output_filename, indel_type, strs_filename=None):
+    lines = []
+    regions_by_chromosome = {}
+    chromosomes = []
+    with open(indels_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 6:
+                continue
+
+            if fields[0] not in regions_by_chromosome:
+                chromosomes.append(fields[0])
+                regions_by_chromosome[fields[0]] = []
+
+            regions_by_chromosome[fields[0]].append((int(fields[1]), int(fields[2]), len(lines)))
+            lines.append(fields)
+
+    tracks = [
+        TrackSweep(read_track(read_coverage_filename), chromosomes, read_coverage_filename),
+        TrackSweep(read_track(contig_depth_filename), chromosomes, contig_depth_filename)
+    ]
+    if strs_filename is not None:
+        tracks.append(TrackSweep(read_track(strs_filename), chromosomes, strs_filename))
+
+    annotations = [None] * len(lines)
+    for chromosome in chromosomes:
+        for start, end, index in sorted(regions_by_chromosome[chromosome]):
+            read_coverage = [get_number(value) for value in tracks[0].overlaps(chromosome, start, end)] or [0.0]
+            contig_depth = [get_number(value) for value in tracks[1].overlaps(chromosome, start, end)] or [0.0]
+            annotation = [
+                "%.5g" % max(contig_depth),
+                "%2.2f" % (sum(read_coverage) / len(read_coverage))
+            ]
+
+            if strs_filename is not None:
+                strs = tracks[2].overlaps(chromosome, start, end)
+                annotation.append(strs[0] if len(strs) > 0 and strs[0] != "." else "0")
+
+            annotations[index] = annotation
+
+    with open(output_filename, "w") as oh:
+        for fields, annotation in zip(lines, annotations):
+            oh.write("\t".join(fields[:6] + annotation + [indel_type]) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("indels", help="BED file of indels with assembled contig support in the sixth column")
+    parser.add_argument("read_coverage", help="sorted BED file of read coverage")
+    parser.add_argument("contig_depth", help="sorted BED file of assembled contig depth")
+    parser.add_argument("output", help="annotated indels")
+    parser.add_argument("indel_type", help="type of indel to annotate output with")
+    parser.add_argument("--strs", help="sorted BED file of short tandem repeats to annotate indels with")
+    args = parser.parse_args()
+
+    annotate_indels(args.indels, args.read_coverage, args.contig_depth, args.output, args.indel_type, args.strs)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+Assemble reads for a single region of the reference and align the polished
+assembly back to that region.
+
+The steps of the assembly run as function calls in this process in the current
+working directory. External tools run in a bounded pool of subprocesses so
+independent steps (e.g., converting reads for the assembler and for mapping)
+run at the same time. Outputs and status lines written to the assembly log are
+the same as those of the original Snakemake-based local assembly.
+
+Wall time, CPU time, peak memory, and I/O of each stage are written as JSON
+lines to a telemetry file (see assembly_telemetry.py).
+
+Steps:
+  1. get reads for the region
+  2. convert reads to FASTA, FASTQ, and bas.h5
+  3. assemble reads with PBcR
+  4. map reads back to the assembly
+  5. polish the assembly with quiver
+  6. trim lowercase (low quality) sequence from the consensus
+  7. align the consensus to the reference region
+"""
+import argparse
+from assembly_telemetry import StageTelemetry, run_command
+from convert_region_reads import convert_reads
+from io_admission import estimate_region_bytes
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import subprocess
+from trim_lowercase import trim_lowercase
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CELERA_SPEC = os.path.join(os.path.dirname(SCRIPTS_DIR), "celera", "pacbio.local_human.spec")
+
+# Parameters for PBcR.
+READ_LENGTH = 1000
+PARTITIONS = 50
+MIN_COVERAGE = 5
+
+# PBcR is stopped after a number of seconds that grows with the length of the
+# region and the number of reads to assemble. The scale multiplies the whole
+# timeout (e.g., to give regions a larger budget when they are retried).
+TIMEOUT_BASE_SECONDS = 60
+TIMEOUT_SECONDS_PER_BASE = 0.01
+TIMEOUT_SECONDS_PER_READ = 3.0
+MIN_TIMEOUT_SECONDS = 120
+
+# Exit code of `timeout` when the command timed out.
+TIMEOUT_EXIT_CODE = 124
+
+# Files produced by PBcR for contigs and unitigs.
+ASSEMBLY_OUTPUT = "local/9-terminator/asm.ctg.fasta"
+UNITIG_OUTPUT = "local/9-terminator/asm.utg.fasta"
+
+
+class RegionAssembler(object):
+    """
+    Run each step of a local assembly for the given region in the current
+    working directory.
+    """
+    def __init__(self, region, reference, alignments, input_reads, log, mapping_quality, alignment_parameters,
+                 region_reads=None, celera_spec=DEFAULT_CELERA_SPEC, threads=4, io_lock_dir=".io_admission",
+                 max_readers=0, max_bytes_per_second=0, telemetry="telemetry.jsonl", timeout_scale=1.0):
+        self.region = region
+        self.reference = reference
+        self.alignments = alignments
+        self.log = log
+        self.mapping_quality = mapping_quality
+        self.alignment_parameters = alignment_parameters
+        self.region_reads = region_reads
+        self.celera_spec = celera_spec
+        self.threads = threads
+        self.io_lock_dir = io_lock_dir
+        self.max_readers = max_readers
+        self.max_bytes_per_second = max_bytes_per_second
+        self.timeout_scale = timeout_scale
+        self.read_count = 0
+
+        # Convert filesystem-safe region of "chrom-start-end" to the
+        # more-standard region of "chrom:start-end" and calculate its size.
+        chromosome, start, end = region.rsplit("-", 2)
+        self.standard_region = "%s:%s-%s" % (chromosome, start, end)
+        self.region_size = int(end) - int(start)
+
+        # Get a sample .bax.h5 file from the given list of input reads.
+        with open(input_reads, "r") as fh:
+            self.bas_template = next(fh).strip()
+
+        self.telemetry = StageTelemetry(region, telemetry)
+        self.pool = ThreadPool(threads)
+
+    def run_command(self, command):
+        run_command(command, self.telemetry)
+
+    def log_status(self, status):
+        with open(self.log, "a") as oh:
+            oh.write("%s\t%s\n" % (self.region, status))
+
+    def estimate_bytes_to_read(self):
+        """
+        Return the approximate compressed bytes read from all BAMs for this
+        region based on the size of each BAM and the reference length.
+        """
+        with open("%s.fai" % self.reference, "r") as fh:
+            reference_length = sum([int(line.split("\t")[1]) for line in fh if line.strip()])
+
+        with open(self.alignments, "r") as fh:
+            bams = [line.strip() for line in fh if line.strip()]
+
+        return sum([estimate_region_bytes(os.path.getsize(bam), reference_length, self.region_size) for bam in bams])
+
+    def get_reads(self):
+        # Use reads extracted for this region ahead of assembly when they
+        # exist. Otherwise, query each BAM for the region once a reader slot is
+        # available.
+        if self.region_reads is not None and os.path.exists(self.region_reads):
+            shutil.copy(self.region_reads, "reads.sam")
+        else:
+            self.run_command(
+                "head -n 1 %s | xargs -i samtools view -H {} > reads.sam; "
+                "python %s/io_admission.py --lock_dir %s --max_readers %s --max_bytes_per_second %s --bytes %i -- "
+                "xargs -a %s -i samtools view -q %s {} %s >> reads.sam" % (
+                    self.alignments, SCRIPTS_DIR, self.io_lock_dir, self.max_readers, self.max_bytes_per_second,
+                    self.estimate_bytes_to_read() if self.max_bytes_per_second > 0 else 0,
+                    self.alignments, self.mapping_quality, self.standard_region
+                )
+            )
+
+    def convert_reads_to_fasta_and_fastq(self):
+        with open("reads.sam", "r") as sam_fh:
+            with open("reads.fasta", "w") as fasta_fh:
+                with open("reads.fastq", "w") as fastq_fh:
+                    self.read_count = convert_reads(sam_fh, fasta_fh, fastq_fh)
+
+    def convert_reads_to_bas(self):
+        self.run_command("samtobas reads.sam reads.bas.h5")
+
+    def extract_reference_sequence(self):
+        with open("reference_region.bed", "w") as oh:
+            oh.write("%s\n" % "\t".join(self.region.rsplit("-", 2)))
+
+        self.run_command("bedtools getfasta -fi %s -bed reference_region.bed -fo reference_region.fasta" % self.reference)
+
+    def get_timeout(self):
+        """
+        Return the number of seconds to allow PBcR to run for this region.
+        """
+        timeout = TIMEOUT_BASE_SECONDS + TIMEOUT_SECONDS_PER_BASE * self.region_size + TIMEOUT_SECONDS_PER_READ * self.read_count
+        return int(max(timeout, MIN_TIMEOUT_SECONDS) * self.timeout_scale)
+
+    def assemble_reads(self):
+        assembly_exists = False
+
+        try:
+            self.run_command(
+                "timeout %is PBcR -threads %s -length %s -partitions %s -l local -s %s -fastq reads.fastq genomeSize=%s assembleMinCoverage=%s &> assembly.log" % (
+                    self.get_timeout(), self.threads, READ_LENGTH, PARTITIONS, self.celera_spec, self.region_size, MIN_COVERAGE
+                )
+            )
+        except subprocess.CalledProcessError as e:
+            if e.returncode == TIMEOUT_EXIT_CODE:
+                self.log_status("assembly_timed_out")
+            else:
+                self.log_status("assembly_crashed")
+
+        if os.path.exists(ASSEMBLY_OUTPUT) and os.stat(ASSEMBLY_OUTPUT).st_size > 0:
+            shutil.copy(ASSEMBLY_OUTPUT, "assembly.fasta")
+            self.log_status("assembly_exists")
+            assembly_exists = True
+        elif os.path.exists(UNITIG_OUTPUT) and os.stat(UNITIG_OUTPUT).st_size > 0:
+            shutil.copy(UNITIG_OUTPUT, "assembly.fasta")
+            self.log_status("unitig_assembly_exists")
+            assembly_exists = True
+        else:
+            self.log_status("no_assembly_exists")
+
+        # Create an empty assembly for failed regions.
+        if not assembly_exists:
+            with open("assembly.fasta", "w") as oh:
+                oh.write(">%s\nN\n" % self.region)
+
+    def index_assembly(self):
+        self.run_command("samtools faidx assembly.fasta")
+
+    def map_reads_to_assembly(self):
+        self.run_command("blasr reads.bas.h5 assembly.fasta -sam -bestn 1 -out /dev/stdout -nproc %s | samtools view -h -F 0x4 -S - > alignment.sam" % self.threads)
+
+    def convert_assembly_alignments_to_hdf5(self):
+        self.run_command(
+            "samtoh5 alignment.sam assembly.fasta alignment.cmp.h5 -useShortRefName; "
+            "cmph5tools.py sort --deep alignment.cmp.h5; "
+            "loadPulses reads.bas.h5 alignment.cmp.h5 -metrics InsertionQV,DeletionQV,SubstitutionQV,MergeQV,SubstitutionTag,DeletionTag; "
+            "%s/LoadGenericChemistry.py %s alignment.cmp.h5" % (SCRIPTS_DIR, self.bas_template)
+        )
+
+    def quiver_assembly(self):
+        try:
+            self.run_command("quiver -j %s --referenceFilename assembly.fasta alignment.cmp.h5 -o consensus.fasta" % self.threads)
+
+            # Prefix consensus names with the region they were assembled from.
+            with open("consensus.fasta", "r") as fh:
+                lines = fh.readlines()
+
+            with open("consensus.fasta", "w") as oh:
+                for line in lines:
+                    if line.startswith(">") and len(line.rstrip("\n")) > 1:
+                        line = ">%s|%s" % (self.region, line[1:])
+
+                    oh.write(line)
+        except subprocess.CalledProcessError:
+            self.log_status("quiver_failed")
+            shutil.copy("assembly.fasta", "consensus.fasta")
+
+    def trim_consensus(self):
+        trim_lowercase("consensus.fasta", "consensus.trimmed.fasta", False)
+
+    def align_consensus_to_reference_region(self):
+        self.run_command(
+            """blasr consensus.trimmed.fasta reference_region.fasta -clipping subread -out /dev/stdout -sam %s | samtools view -q %s - | awk 'OFS="\\t" { sub(/:/, "-", $3); num_of_pieces=split($3, pieces, "-"); $3 = pieces[1]; $4 = pieces[2] + $4; print }' | sed 's/RG:Z:\\w\\+\\t//' > consensus_reference_alignment.sam""" % (
+                self.alignment_parameters, self.mapping_quality
+            )
+        )
+
+    def run_in_parallel(self, *steps):
+        """
+        Run the given steps in the pool of subprocesses and wait for all of them
+        to finish.
+        """
+        results = [self.pool.apply_async(step) for step in steps]
+        for result in results:
+            result.get()
+
+    def assemble(self):
+        """
+        Run all steps of the local assembly in order and record telemetry for
+        each stage.
+        """
+        try:
+            with self.telemetry.stage("read_extraction"):
+                self.get_reads()
+
+            with self.telemetry.stage("format_conversion"):
+                self.run_in_parallel(self.convert_reads_to_fasta_and_fastq, self.convert_reads_to_bas)
+
+            with self.telemetry.stage("assembly"):
+                self.assemble_reads()
+
+            with self.telemetry.stage("mapping"):
+                self.run_in_parallel(self.index_assembly, self.map_reads_to_assembly)
+                self.convert_assembly_alignments_to_hdf5()
+
+            with self.telemetry.stage("quiver"):
+                self.quiver_assembly()
+
+            with self.telemetry.stage("trim"):
+                self.trim_consensus()
+
+            with self.telemetry.stage("reference_alignment"):
+                self.extract_reference_sequence()
+                self.align_consensus_to_reference_region()
+        finally:
+            self.pool.close()
+            self.pool.join()
+
+        os.remove("reference_region.fasta")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("region", help="region to assemble in the form of chrom-start-end")
+    parser.add_argument("reference", help="FASTA file of the reference")
+    parser.add_argument("alignments", help="text file with one absolute path to a BAM of raw read alignments per line")
+    parser.add_argument("reads", help="text file with one absolute path to a PacBio reads file (.bax.h5) per line")
+    parser.add_argument("log", help="log file to append assembly status lines to")
+    parser.add_argument("--region_reads", help="SAM file of reads for this region extracted ahead of assembly")
+    parser.add_argument("--mapping_quality", type=int, default=30, help="minimum mapping quality of reads and assembly alignments")
+    parser.add_argument("--alignment_parameters", default="", help="BLASR parameters to use to align the assembly to the reference")
+    parser.add_argument("--celera_spec", default=DEFAULT_CELERA_SPEC, help="Celera spec file for PBcR")
+    parser.add_argument("--threads", type=int, default=4, help="number of threads for each tool and of concurrent steps")
+    parser.add_argument("--io_lock_dir", default=".io_admission", help="directory shared by all jobs reading BAMs to limit concurrent I/O")
+    parser.add_argument("--max_readers", type=int, default=0, help="maximum number of jobs reading BAMs at once (0 for no limit)")
+    parser.add_argument("--max_bytes_per_second", type=int, default=0, help="maximum aggregate bytes per second read from BAMs by all jobs (0 for no limit)")
+    parser.add_argument("--timeout_scale", type=float, default=1.0, help="multiplier for the time allowed to assemble the region based on its length and number of reads")
+    parser.add_argument("--telemetry", default="telemetry.jsonl", help="JSON-lines file to append per-stage timing and resource usage to")
+    args = parser.parse_args()
+
+    assembler = RegionAssembler(
+        args.region, args.reference, args.alignments, args.reads, args.log, args.mapping_quality,
+        args.alignment_parameters, args.region_reads, args.celera_spec, args.threads, args.io_lock_dir,
+        args.max_readers, args.max_bytes_per_second, args.telemetry, args.timeout_scale
+    )
+    assembler.assemble()
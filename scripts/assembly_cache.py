@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache of local assembly results.
+
+Each region's result is stored under a key computed from everything that
+determines the assembly: the region coordinates, the names of the reads used to
+assemble it, the minimum mapping quality of those reads, the assembler spec,
+the script used to run the assembly, and any other parameters such as the
+alignment parameters for mapping the assembly back to the reference. Regions
+whose keys match a cached entry can reuse the cached consensus alignments and
+assembly status instead of assembling again.
+
+The cache is capped at a maximum size. When a new entry pushes the cache over
+its limit, the least recently used entries are evicted.
+"""
+import argparse
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+# Increment this version when the content of cached entries changes to avoid
+# reusing incompatible entries.
+CACHE_VERSION = "1"
+
+GIGABYTE = 1024 ** 3
+
+
+def get_read_names(reads_filename):
+    """
+    Return the sorted list of unique read names from the given SAM file.
+    """
+    read_names = set()
+    with open(reads_filename, "r") as fh:
+        for line in fh:
+            if not line.startswith("@"):
+                read_names.add(line.split("\t", 1)[0])
+
+    return sorted(read_names)
+
+
+def get_cache_key(region, reads_filename, mapping_quality, input_filenames, parameters):
+    """
+    Return a hex digest identifying the assembly of the given region from the
+    reads in the given SAM file, the contents of the given input files (e.g.,
+    assembler spec), and the given list of parameters.
+    """
+    digest = hashlib.sha1()
+    digest.update(("version=%s\n" % CACHE_VERSION).encode())
+    digest.update(("region=%s\n" % region).encode())
+    digest.update(("mapping_quality=%s\n" % mapping_quality).encode())
+
+    for read_name in get_read_names(reads_filename):
+        digest.update(("read=%s\n" % read_name).encode())
+
+    for input_filename in input_filenames:
+        with open(input_filename, "rb") as fh:
+            digest.update(hashlib.sha1(fh.read()).hexdigest().encode())
+
+    for parameter in parameters:
+        digest.update(("parameter=%s\n" % parameter).encode())
+
+    return digest.hexdigest()
+
+
+def _get_directory_size(path):
+    return sum([os.path.getsize(os.path.join(path, filename)) for filename in os.listdir(path)])
+
+
+class AssemblyCache(object):
+    """
+    Directory of cached assembly results with one subdirectory per key and a
+    maximum total size in bytes.
+    """
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, output_dir):
+        """
+        Copy the files cached for the given key into the given output directory
+        and return True. Returns False if the key is not in the cache.
+        """
+        entry_dir = self._get_entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return False
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        try:
+            for filename in os.listdir(entry_dir):
+                shutil.copy(os.path.join(entry_dir, filename), os.path.join(output_dir, filename))
+        except (IOError, OSError):
+            # The entry was evicted while it was being copied.
+            return False
+
+        # Mark the entry as recently used.
+        now = time.time()
+        os.utime(entry_dir, (now, now))
+
+        return True
+
+    def store(self, key, filenames):
+        """
+        Store the given files under the given key and evict old entries if the
+        cache is larger than its maximum size.
+        """
+        entry_dir = self._get_entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+
+        # Copy files into a temporary directory first and move it into place so
+        # other jobs never see a partial entry.
+        tmp_dir = os.path.join(self.cache_dir, "tmp.%s.%s" % (os.getpid(), key))
+        os.makedirs(tmp_dir)
+        for filename in filenames:
+            shutil.copy(filename, tmp_dir)
+
+        try:
+            os.makedirs(os.path.dirname(entry_dir))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another job stored the same entry first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits within its
+        maximum size.
+        """
+        if self.max_size is None:
+            return
+
+        with open(os.path.join(self.cache_dir, ".lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+            entries = []
+            total_size = 0
+            for prefix in os.listdir(self.cache_dir):
+                prefix_dir = os.path.join(self.cache_dir, prefix)
+                if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                    continue
+
+                for key in os.listdir(prefix_dir):
+                    entry_dir = os.path.join(prefix_dir, key)
+                    size = _get_directory_size(entry_dir)
+                    entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+                    total_size += size
+
+            for mtime, size, entry_dir in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total_size -= size
+
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def key(args):
+    sys.stdout.write("%s\n" % get_cache_key(args.region, args.reads, args.mapping_quality, args.inputs, args.parameters))
+    return 0
+
+
+def fetch(args):
+    return 0 if AssemblyCache(args.cache_dir).fetch(args.key, args.output_dir) else 1
+
+
+def store(args):
+    AssemblyCache(args.cache_dir, int(args.max_gb * GIGABYTE)).store(args.key, args.files)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_key = subparsers.add_parser("key", help="print the cache key for a region's assembly")
+    parser_key.add_argument("region", help="region to assemble in the form of chrom-start-end")
+    parser_key.add_argument("reads", help="SAM file of reads to assemble for the region")
+    parser_key.add_argument("--mapping_quality", default="", help="minimum mapping quality of reads used for assembly")
+    parser_key.add_argument("--inputs", nargs="*", default=[], help="files whose contents determine the assembly (e.g., assembler spec)")
+    parser_key.add_argument("--parameters", nargs="*", default=[], help="other parameters that determine the assembly")
+    parser_key.set_defaults(func=key)
+
+    parser_fetch = subparsers.add_parser("fetch", help="copy a cached assembly into a directory and exit with 1 if it is not cached")
+    parser_fetch.add_argument("cache_dir", help="directory of cached assemblies")
+    parser_fetch.add_argument("key", help="cache key for the region's assembly")
+    parser_fetch.add_argument("output_dir", help="directory to copy the cached files into")
+    parser_fetch.set_defaults(func=fetch)
+
+    parser_store = subparsers.add_parser("store", help="store the files of a region's assembly in the cache")
+    parser_store.add_argument("cache_dir", help="directory of cached assemblies")
+    parser_store.add_argument("key", help="cache key for the region's assembly")
+    parser_store.add_argument("files", nargs="+", help="files to cache for the region")
+    parser_store.add_argument("--max_gb", type=float, default=10, help="maximum size of the cache in gigabytes")
+    parser_store.set_defaults(func=store)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+Estimate the cost of local assemblies and order regions to assemble by
+decreasing estimated cost.
+
+The runtime of a region's assembly is modeled as a linear function of the
+region's length, the number of reads expected in the region, and the total bases
+of reads covering the region (length times mean coverage). Read counts are
+estimated from the number of mapped reads per chromosome in each BAM index, so
+no reads are loaded to estimate costs.
+
+Assembling the most expensive regions first (longest processing time first)
+keeps a few huge regions from finishing last on an otherwise idle cluster.
+Predicted and actual runtimes of assemblies are recorded by the local assembly
+rules and can be used to refit the model with the `fit` command.
+
+The `savings` command reports the assembly time saved by regions skipped by the
+read prescreen (see extract_region_reads.py). Predicted savings are the
+estimated costs of skipped regions. Realized savings scale the predicted savings
+by the ratio of actual to predicted runtimes of regions that were assembled.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Default coefficients in seconds. Refit these from recorded runtimes with the
+# `fit` command.
+DEFAULT_MODEL = {
+    "intercept": 60.0,
+    "length": 0.005,
+    "reads": 0.5,
+    "read_bases": 0.00005
+}
+
+# Columns of recorded runtimes.
+RUNTIME_COLUMNS = ("region", "length", "reads", "coverage", "predicted", "actual")
+
+
+def load_model(model_filename=None):
+    """
+    Return model coefficients from the given JSON file or the default model if
+    no file is given.
+    """
+    if model_filename is None:
+        return dict(DEFAULT_MODEL)
+
+    with open(model_filename, "r") as fh:
+        return json.load(fh)
+
+
+def estimate_cost(model, length, reads, coverage):
+    """
+    Return the estimated runtime in seconds for a region with the given length,
+    number of reads, and mean coverage.
+
+    >>> estimate_cost({"intercept": 1.0, "length": 0.5, "reads": 2.0, "read_bases": 0.1}, 10, 3, 2.0)
+    14.0
+    """
+    return (
+        model["intercept"] +
+        model["length"] * length +
+        model["reads"] * reads +
+        model["read_bases"] * length * coverage
+    )
+
+
+def get_read_densities(alignments_filename):
+    """
+    Return the number of mapped reads per base for each chromosome summed across
+    all BAMs in the given file of filenames using only the BAM indices.
+    """
+    with open(alignments_filename, "r") as fh:
+        bams = [line.strip() for line in fh if line.strip()]
+
+    mapped_reads = {}
+    lengths = {}
+    for bam in bams:
+        output = subprocess.check_output(["samtools", "idxstats", bam]).decode()
+        for line in output.splitlines():
+            chromosome, length, mapped, unmapped = line.split("\t")
+            if chromosome == "*" or int(length) == 0:
+                continue
+
+            mapped_reads[chromosome] = mapped_reads.get(chromosome, 0) + int(mapped)
+            lengths[chromosome] = int(length)
+
+    return dict([(chromosome, mapped_reads[chromosome] / float(lengths[chromosome])) for chromosome in mapped_reads])
+
+
+def estimate_region_costs(regions_filename, read_densities, model):
+    """
+    Return a list of regions from the given BED file with mean coverage in the
+    fourth column as lists of (chromosome, start, end, coverage, estimated reads,
+    estimated cost) sorted by decreasing cost.
+    """
+    regions = []
+    with open(regions_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip().split("\t")
+            if len(fields) < 3:
+                continue
+
+            chromosome, start, end = fields[0], int(fields[1]), int(fields[2])
+            coverage = float(fields[3]) if len(fields) > 3 else 0.0
+            length = end - start
+            reads = int(round(read_densities.get(chromosome, 0.0) * length))
+            cost = estimate_cost(model, length, reads, coverage)
+            regions.append((chromosome, start, end, coverage, reads, cost))
+
+    # Python's sort is stable, so regions with equal costs stay in their
+    # original order.
+    return sorted(regions, key=lambda region: -region[5])
+
+
+def fit_model(runtimes_filename):
+    """
+    Fit model coefficients to the recorded runtimes in the given file by least
+    squares and return the model with the number of runtimes used to fit it.
+    Negative coefficients are set to zero.
+    """
+    import numpy as np
+
+    features = []
+    runtimes = []
+    with open(runtimes_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip().split("\t")
+            if len(fields) != len(RUNTIME_COLUMNS) or fields[0] == RUNTIME_COLUMNS[0]:
+                continue
+
+            record = dict(zip(RUNTIME_COLUMNS, fields))
+            length = float(record["length"])
+            features.append([1.0, length, float(record["reads"]), length * float(record["coverage"])])
+            runtimes.append(float(record["actual"]))
+
+    if len(runtimes) < len(DEFAULT_MODEL):
+        raise ValueError("Need at least %i recorded runtimes to fit the model; found %i" % (len(DEFAULT_MODEL), len(runtimes)))
+
+    coefficients = np.linalg.lstsq(np.array(features), np.array(runtimes), rcond=-1)[0]
+    coefficients = [max(float(coefficient), 0.0) for coefficient in coefficients]
+    model = dict(zip(("intercept", "length", "reads", "read_bases"), coefficients))
+
+    return model, len(runtimes)
+
+
+def get_region_size(region):
+    """
+    Return the length of the region with the given name.
+
+    >>> get_region_size("chr1-100-250")
+    150
+    """
+    chromosome, start, end = region.rsplit("-", 2)
+    return int(end) - int(start)
+
+
+def estimate_savings(prescreen_filenames, regions_filename, model, runtimes_filename=None):
+    """
+    Return a dictionary with the number of eligible and skipped regions in the
+    given prescreen files, the predicted seconds saved by skipping regions, and
+    the realized seconds saved calibrated by the ratio of actual to predicted
+    runtimes in the given runtimes file.
+
+    Regions without estimated costs in the given regions file are estimated with
+    the given model from their length and number of reads.
+    """
+    costs = {}
+    with open(regions_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip().split("\t")
+            if len(fields) >= 6:
+                costs["-".join(fields[:3])] = float(fields[5])
+
+    eligible = 0
+    skipped = 0
+    predicted = 0.0
+    for prescreen_filename in prescreen_filenames:
+        with open(prescreen_filename, "r") as fh:
+            for line in fh:
+                region, reads, evidence_reads, region_eligible, region_skipped = line.rstrip("\n").split("\t")
+                if region == "region":
+                    continue
+
+                eligible += int(region_eligible)
+                if region_skipped == "1":
+                    skipped += 1
+                    if region in costs:
+                        predicted += costs[region]
+                    else:
+                        predicted += estimate_cost(model, get_region_size(region), int(reads), 0.0)
+
+    total_predicted = 0.0
+    total_actual = 0.0
+    runtimes = 0
+    if runtimes_filename is not None:
+        with open(runtimes_filename, "r") as fh:
+            for line in fh:
+                fields = line.rstrip().split("\t")
+                if len(fields) != len(RUNTIME_COLUMNS) or fields[0] == RUNTIME_COLUMNS[0]:
+                    continue
+
+                record = dict(zip(RUNTIME_COLUMNS, fields))
+                total_predicted += float(record["predicted"])
+                total_actual += float(record["actual"])
+                runtimes += 1
+
+    if total_predicted > 0:
+        calibration = total_actual / total_predicted
+    else:
+        calibration = 1.0
+
+    return {
+        "eligible_regions": eligible,
+        "skipped_regions": skipped,
+        "predicted_seconds_saved": round(predicted, 1),
+        "realized_seconds_saved": round(predicted * calibration, 1),
+        "actual_to_predicted_runtime": round(calibration, 3),
+        "runtimes": runtimes
+    }
+
+
+def estimate(args):
+    model = load_model(args.model)
+    regions = estimate_region_costs(args.regions, get_read_densities(args.alignments), model)
+
+    with open(args.output, "w") as oh:
+        for chromosome, start, end, coverage, reads, cost in regions:
+            oh.write("%s\t%i\t%i\t%s\t%i\t%.1f\n" % (chromosome, start, end, coverage, reads, cost))
+
+    sys.stderr.write("Estimated %.1f total seconds of assembly for %i regions\n" % (sum([region[5] for region in regions]), len(regions)))
+    return 0
+
+
+def fit(args):
+    model, count = fit_model(args.runtimes)
+
+    with open(args.model, "w") as oh:
+        json.dump(model, oh, indent=4, sort_keys=True)
+        oh.write("\n")
+
+    sys.stderr.write("Fit model to %i recorded runtimes: %s\n" % (count, json.dumps(model, sort_keys=True)))
+    return 0
+
+
+def savings(args):
+    result = estimate_savings(args.prescreen, args.regions, load_model(args.model), args.runtimes)
+    columns = ("eligible_regions", "skipped_regions", "predicted_seconds_saved", "realized_seconds_saved", "actual_to_predicted_runtime", "runtimes")
+
+    sys.stdout.write("%s\n" % "\t".join(columns))
+    sys.stdout.write("%s\n" % "\t".join([str(result[column]) for column in columns]))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_estimate = subparsers.add_parser("estimate", help="estimate assembly costs of regions and sort regions by decreasing cost")
+    parser_estimate.add_argument("alignments", help="text file with one absolute path to a BAM of raw read alignments per line")
+    parser_estimate.add_argument("regions", help="BED file of regions to assemble with mean coverage in the fourth column")
+    parser_estimate.add_argument("output", help="BED file of regions with coverage, estimated reads, and estimated cost in seconds sorted by decreasing cost")
+    parser_estimate.add_argument("--model", help="JSON file of model coefficients produced by the fit command")
+    parser_estimate.set_defaults(func=estimate)
+
+    parser_fit = subparsers.add_parser("fit", help="fit model coefficients to recorded assembly runtimes")
+    parser_fit.add_argument("runtimes", help="tab-delimited file of predicted and actual assembly runtimes recorded by local assembly")
+    parser_fit.add_argument("model", help="JSON file to write model coefficients to")
+    parser_fit.set_defaults(func=fit)
+
+    parser_savings = subparsers.add_parser("savings", help="report predicted and realized assembly time saved by prescreened regions")
+    parser_savings.add_argument("regions", help="BED file of regions to assemble with optional estimated costs")
+    parser_savings.add_argument("prescreen", nargs="+", help="prescreen files written by extract_region_reads.py")
+    parser_savings.add_argument("--runtimes", help="tab-delimited file of predicted and actual assembly runtimes recorded by local assembly")
+    parser_savings.add_argument("--model", help="JSON file of model coefficients produced by the fit command")
+    parser_savings.set_defaults(func=savings)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
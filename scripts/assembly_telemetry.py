@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Record and summarize per-stage timing and resource usage of local assemblies.
+
+Each stage of a region's assembly is written as one JSON record per line with
+the stage's wall time, CPU time, peak resident set size, and bytes read from and
+written to storage. Resource usage of external tools is collected from the
+kernel when each tool exits, including usage by all of the tool's descendants.
+Resource usage of work done in the assembly process itself is measured as the
+change in the process's usage across the stage.
+
+The kernel only reports a process's peak resident set size over its lifetime,
+so the stage's peak resident set size covers the stage's external tools alone.
+The assembly process's own peak so far is recorded separately as
+`process_max_rss_kb` and never decreases across the stages of a region.
+"""
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+# Block counts from the kernel are in 512-byte units.
+BLOCK_SIZE = 512
+
+# Default number of slowest regions to report.
+DEFAULT_SLOWEST_REGIONS = 10
+
+# Percentiles of stage metrics to report.
+PERCENTILES = (50, 90, 99)
+
+
+class StageTelemetry(object):
+    """
+    Collect resource usage of the stages of one region's assembly and write
+    one JSON record per stage to the given file.
+    """
+    def __init__(self, region, output_filename):
+        self.region = region
+        self.output_filename = output_filename
+        self.lock = threading.Lock()
+        self.children = None
+
+    def add_child_usage(self, usage):
+        """
+        Add the resource usage of an exited child process to the current stage.
+        """
+        with self.lock:
+            if self.children is None:
+                return
+
+            self.children["user_seconds"] += usage.ru_utime
+            self.children["system_seconds"] += usage.ru_stime
+            self.children["max_rss_kb"] = max(self.children["max_rss_kb"], usage.ru_maxrss)
+            self.children["bytes_read"] += usage.ru_inblock * BLOCK_SIZE
+            self.children["bytes_written"] += usage.ru_oublock * BLOCK_SIZE
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the stage with the given name while the context is active and
+        write its record when the context exits.
+        """
+        with self.lock:
+            self.children = {"user_seconds": 0.0, "system_seconds": 0.0, "max_rss_kb": 0, "bytes_read": 0, "bytes_written": 0}
+
+        start_time = time.time()
+        start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            end_usage = resource.getrusage(resource.RUSAGE_SELF)
+            with self.lock:
+                children = self.children
+                self.children = None
+
+            record = {
+                "region": self.region,
+                "stage": name,
+                "succeeded": succeeded,
+                "wall_seconds": round(time.time() - start_time, 3),
+                "user_seconds": round(children["user_seconds"] + end_usage.ru_utime - start_usage.ru_utime, 3),
+                "system_seconds": round(children["system_seconds"] + end_usage.ru_stime - start_usage.ru_stime, 3),
+                "max_rss_kb": children["max_rss_kb"],
+                "process_max_rss_kb": end_usage.ru_maxrss,
+                "bytes_read": children["bytes_read"] + (end_usage.ru_inblock - start_usage.ru_inblock) * BLOCK_SIZE,
+                "bytes_written": children["bytes_written"] + (end_usage.ru_oublock - start_usage.ru_oublock) * BLOCK_SIZE
+            }
+            with open(self.output_filename, "a") as oh:
+                oh.write("%s\n" % json.dumps(record, sort_keys=True))
+
+
+def run_command(command, telemetry=None):
+    """
+    Run the given command with bash, add its resource usage to the current
+    stage of the given telemetry, and raise CalledProcessError if it fails.
+    """
+    process = subprocess.Popen("set -o pipefail; %s" % command, shell=True, executable="/bin/bash")
+    pid, status, usage = os.wait4(process.pid, 0)
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    if telemetry is not None:
+        telemetry.add_child_usage(usage)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def load_records(filenames):
+    """
+    Return all records from the given JSON-lines files.
+    """
+    records = []
+    for filename in filenames:
+        with open(filename, "r") as fh:
+            for line in fh:
+                if line.strip():
+                    records.append(json.loads(line))
+
+    return records
+
+
+def get_percentile(values, percentile):
+    """
+    Return the given percentile of the given values by the nearest-rank method.
+
+    >>> get_percentile([5, 1, 4, 2, 3], 50)
+    3
+    >>> get_percentile([5, 1, 4, 2, 3], 99)
+    5
+    """
+    values = sorted(values)
+    rank = max(int(-(-percentile * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+def summarize(records, slowest_regions=DEFAULT_SLOWEST_REGIONS, output=sys.stdout):
+    """
+    Write percentiles of wall time, CPU time, peak memory, and I/O per stage and
+    the regions with the longest total wall time to the given output.
+    """
+    stages = []
+    records_by_stage = {}
+    wall_by_region = {}
+    for record in records:
+        if record["stage"] not in records_by_stage:
+            stages.append(record["stage"])
+            records_by_stage[record["stage"]] = []
+
+        records_by_stage[record["stage"]].append(record)
+        wall_by_region.setdefault(record["region"], []).append((record["wall_seconds"], record["stage"]))
+
+    total_wall = sum([record["wall_seconds"] for record in records]) or 1.0
+
+    columns = ["stage", "count", "failed", "wall_fraction"]
+    metrics = ("wall_seconds", "cpu_seconds", "max_rss_kb", "bytes_read", "bytes_written")
+    for metric in metrics:
+        columns.extend(["%s_p%i" % (metric, percentile) for percentile in PERCENTILES])
+        columns.append("%s_max" % metric)
+
+    output.write("%s\n" % "\t".join(columns))
+    for stage in stages:
+        stage_records = records_by_stage[stage]
+        values = {
+            "wall_seconds": [record["wall_seconds"] for record in stage_records],
+            "cpu_seconds": [record["user_seconds"] + record["system_seconds"] for record in stage_records],
+            "max_rss_kb": [record["max_rss_kb"] for record in stage_records],
+            "bytes_read": [record["bytes_read"] for record in stage_records],
+            "bytes_written": [record["bytes_written"] for record in stage_records]
+        }
+
+        row = [
+            stage,
+            str(len(stage_records)),
+            str(len([record for record in stage_records if not record["succeeded"]])),
+            "%.3f" % (sum(values["wall_seconds"]) / total_wall)
+        ]
+        for metric in metrics:
+            row.extend([_format_value(get_percentile(values[metric], percentile)) for percentile in PERCENTILES])
+            row.append(_format_value(max(values[metric])))
+
+        output.write("%s\n" % "\t".join(row))
+
+    output.write("\nregion\twall_seconds\tslowest_stage\tslowest_stage_wall_seconds\n")
+    region_totals = sorted(
+        [(sum([wall for wall, stage in stages_walls]), region, max(stages_walls)) for region, stages_walls in wall_by_region.items()],
+        reverse=True
+    )
+    for total, region, slowest_stage in region_totals[:slowest_regions]:
+        output.write("%s\t%.1f\t%s\t%.1f\n" % (region, total, slowest_stage[1], slowest_stage[0]))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return "%.2f" % value
+
+    return str(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_summarize = subparsers.add_parser("summarize", help="report percentiles per stage and the slowest regions")
+    parser_summarize.add_argument("telemetry", nargs="+", help="JSON-lines files of assembly telemetry")
+    parser_summarize.add_argument("--slowest_regions", type=int, default=DEFAULT_SLOWEST_REGIONS, help="number of slowest regions to report")
+    args = parser.parse_args()
+
+    summarize(load_records(args.telemetry), args.slowest_regions)
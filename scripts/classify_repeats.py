@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Classify SV calls annotated with RepeatMasker and TRF by repeat type in a single
+pass, writing one BED file per repeat type.
+
+Calls are classified by the same ordered rules as the cascade of FixMasked.py
+and PrintUniqueEvents.py runs this replaces and each category file is identical
+to the file written by the cascade. Calls with more than the maximum TRF
+fraction in the 20th column are tandem repeats. The masked fraction in the 18th
+column of the remaining calls is recalculated from lowercase bases in the 6th
+column and calls with less than the minimum masked fraction are not masked.
+Masked calls are assigned to the first category whose rule matches the
+annotations in the 7th column, and calls matching no rule are complex.
+"""
+import argparse
+import os
+import re
+import sys
+
+# Maximum fraction of a call's sequence annotated by TRF for calls that are not
+# tandem repeats and minimum fraction of masked bases for calls that are
+# repeats.
+MAX_TRF_FRACTION = "0.8"
+MIN_MASKED_FRACTION = 0.7
+
+# Zero-based indices of columns used to classify calls.
+SEQUENCE_COLUMN = 5
+ANNOTATION_COLUMN = 6
+MASKED_FRACTION_COLUMN = 17
+TRF_FRACTION_COLUMN = 19
+
+# Ordered rules for masked calls as the options of each PrintUniqueEvents.py
+# run in the original cascade.
+RULES = (
+    ("AluY.simple", {"prefix": "AluY", "minPrefix": 1, "maxPrefix": 1, "maxNotPrefix": 0, "maxSTR": 0}),
+    ("AluS.simple", {"prefix": "AluS", "minPrefix": 1, "maxPrefix": 1, "maxNotPrefix": 0, "maxSTR": 0}),
+    ("STR", {"minSTR": 1, "maxNotPrefix": 0}),
+    ("L1HS.simple", {"prefix": "L1HS", "maxNotPrefix": 0}),
+    ("Alu.Mosaic", {"prefix": "Alu", "minPrefix": 1, "maxNotPrefix": 0, "maxSTR": 0}),
+    ("Alu.STR", {"prefix": "Alu", "minSTR": 1, "minPrefix": 1, "maxNotPrefix": 0}),
+    ("ALR", {"prefix": "ALR", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("SVA.simple", {"prefix": "SVA", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("HERV.simple", {"prefix": "HERV", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("L1P", {"prefix": "L1P", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("Beta", {"prefix": "BSR/Beta", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("HSAT", {"prefix": "HSAT", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("MER", {"prefix": "MER", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("L1", {"prefix": "L1", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("LTR", {"prefix": "LTR", "minPrefix": 1, "maxNotPrefix": 0}),
+    ("Singletons", {"max": 1})
+)
+
+TRF_CATEGORY = "TRF"
+NOT_MASKED_CATEGORY = "NotMasked"
+COMPLEX_CATEGORY = "Complex"
+
+# Fields that awk compares as numbers instead of strings.
+AWK_NUMBER = re.compile(r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$")
+
+
+def awk_compare(value, constant):
+    """
+    Return -1, 0, or 1 as awk compares the given field value with the given
+    numeric constant: as numbers if the field looks numeric and otherwise as
+    strings. Missing fields (None) compare as zero.
+
+    >>> awk_compare("0.81", "0.8"), awk_compare("0.80", "0.8"), awk_compare(None, "0.8")
+    (1, 0, -1)
+    >>> awk_compare("NA", "0.8")
+    1
+    """
+    if value is None:
+        left, right = 0.0, float(constant)
+    elif AWK_NUMBER.match(value):
+        left, right = float(value), float(constant)
+    else:
+        left, right = value, constant
+
+    return (left > right) - (left < right)
+
+
+def fix_masked_fraction(fields):
+    """
+    Return the given fields with the masked fraction column recalculated from
+    the lowercase bases in the sequence column as FixMasked.py does.
+
+    >>> fix_masked_fraction(["chr1", "0", "4", "insertion", "4", "acGT"] + ["."] * 12)[MASKED_FRACTION_COLUMN]
+    '0.50'
+    """
+    sequence = fields[SEQUENCE_COLUMN]
+    lowercase = sum([sequence.count(base) for base in ("a", "g", "c", "t")])
+    fields = list(fields)
+    fields[MASKED_FRACTION_COLUMN] = "{:2.2f}".format(float(lowercase) / len(sequence))
+    return fields
+
+
+def rule_matches(annotations, rule):
+    """
+    Return True if the given list of annotations matches the given rule of
+    PrintUniqueEvents.py options.
+
+    >>> rule_matches(["AluYa5"], RULES[0][1])
+    True
+    >>> rule_matches(["AluYa5", "(CA)n"], RULES[0][1])
+    False
+    >>> rule_matches(["AluSx", "(CA)n"], dict(RULES)["Alu.STR"])
+    True
+    >>> rule_matches(["L2"], dict(RULES)["Singletons"]), rule_matches(["L2", "MIR"], dict(RULES)["Singletons"])
+    (True, False)
+    """
+    prefix = rule.get("prefix")
+    count_str_as_not_prefix = rule.get("minNotPrefix") is None and rule.get("maxNotPrefix") is None
+
+    prefix_count = 0
+    not_prefix_count = 0
+    str_count = 0
+    for annotation in annotations:
+        if prefix is not None and annotation[0:len(prefix)] == prefix:
+            prefix_count += 1
+        elif annotation.find(")n") != -1 or annotation.find("_rich") != -1 or annotation.find("-rich") != -1:
+            str_count += 1
+            if count_str_as_not_prefix:
+                not_prefix_count += 1
+        else:
+            not_prefix_count += 1
+
+    limits = (
+        ("min", len(annotations), lambda count, limit: count >= limit),
+        ("minPrefix", prefix_count, lambda count, limit: count >= limit),
+        ("maxPrefix", prefix_count, lambda count, limit: count <= limit),
+        ("minNotPrefix", not_prefix_count, lambda count, limit: count >= limit),
+        ("maxNotPrefix", not_prefix_count, lambda count, limit: count <= limit),
+        ("minSTR", str_count, lambda count, limit: count >= limit),
+        ("maxSTR", str_count, lambda count, limit: count <= limit)
+    )
+    if all([rule.get(name) is None or test(count, rule[name]) for name, count, test in limits]):
+        # PrintUniqueEvents.py requires fewer than the maximum number of
+        # annotations in its combined test...
+        if rule.get("max") is None or len(annotations) < rule["max"]:
+            return True
+
+    # ...but also accepts at most the maximum number on its own.
+    return rule.get("max") is not None and len(annotations) <= rule["max"]
+
+
+def classify_line(line):
+    """
+    Return the category and output line of the given annotated call.
+    """
+    fields = line.split()
+    trf_fraction = fields[TRF_FRACTION_COLUMN] if len(fields) > TRF_FRACTION_COLUMN else None
+    if awk_compare(trf_fraction, MAX_TRF_FRACTION) > 0:
+        return TRF_CATEGORY, line
+
+    fields = fix_masked_fraction(fields)
+    line = "\t".join(fields) + "\n"
+    if float(fields[MASKED_FRACTION_COLUMN]) < MIN_MASKED_FRACTION:
+        return NOT_MASKED_CATEGORY, line
+
+    annotations = fields[ANNOTATION_COLUMN].split(";")
+    for category, rule in RULES:
+        if rule_matches(annotations, rule):
+            return category, line
+
+    return COMPLEX_CATEGORY, line
+
+
+def classify_calls(input_filename, output_dir):
+    """
+    Write each call in the given file to `{output_dir}/{category}.bed` and
+    return the number of calls per category.
+    """
+    categories = [TRF_CATEGORY, NOT_MASKED_CATEGORY] + [category for category, rule in RULES] + [COMPLEX_CATEGORY]
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    output_files = dict([(category, open(os.path.join(output_dir, "%s.bed" % category), "w")) for category in categories])
+    counts = dict([(category, 0) for category in categories])
+    with open(input_filename, "r") as fh:
+        for line in fh:
+            category, output_line = classify_line(line)
+            output_files[category].write(output_line)
+            counts[category] += 1
+
+    for output_file in output_files.values():
+        output_file.close()
+
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("calls", help="BED file of SV calls annotated with RepeatMasker and TRF")
+    parser.add_argument("output_dir", help="directory to write one BED file of calls per repeat type to")
+    args = parser.parse_args()
+
+    counts = classify_calls(args.calls, args.output_dir)
+    sys.stderr.write("Classified %i calls: %s\n" % (
+        sum(counts.values()),
+        ", ".join(["%s=%i" % (category, count) for category, count in sorted(counts.items()) if count > 0])
+    ))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Convert reads extracted for a local assembly region from SAM into the FASTA and
+fake-quality FASTQ files used by the assembler in a single pass.
+
+FASTA records are named after the movie of the first read in the input with a
+running read index (e.g., "m140101_000000/1/1_1001") as with `FormatFasta.py
+--fakename`. FASTQ records are numbered from zero with a constant base quality
+of 40 as with `FastaToFakeFastq.py`.
+"""
+import argparse
+import sys
+
+# Width of sequence lines in FASTA output.
+FASTA_LINE_LENGTH = 50
+
+# Phred quality of 40 for every base in FASTQ output.
+FAKE_QUALITY = "I"
+
+
+def iterate_sam_reads(sam_fh):
+    """
+    Yield the name and sequence of each read in the given SAM file handle.
+    """
+    for line in sam_fh:
+        if line.startswith("@"):
+            continue
+
+        fields = line.split("\t", 10)
+        yield fields[0], fields[9]
+
+
+def convert_reads(sam_fh, fasta_fh, fastq_fh):
+    """
+    Write each read from the given SAM file handle to the given FASTA and FASTQ
+    file handles and return the number of reads written.
+    """
+    movie_name = None
+    index = 0
+    for read_name, sequence in iterate_sam_reads(sam_fh):
+        if movie_name is None:
+            movie_name = read_name.split("/")[0]
+
+        # Read lengths in fake names include the trailing newline of the
+        # original line-based conversion.
+        fasta_fh.write(">%s/%i/1_%i\n" % (movie_name, index + 1, len(sequence) + 1))
+        for i in range(0, len(sequence), FASTA_LINE_LENGTH):
+            fasta_fh.write("%s\n" % sequence[i:i + FASTA_LINE_LENGTH])
+
+        fastq_fh.write("@%i\n%s\n+%i\n%s\n" % (index, sequence, index, FAKE_QUALITY * len(sequence)))
+        index += 1
+
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reads", help="SAM file of reads for a region or '-' for standard input")
+    parser.add_argument("fasta", help="output FASTA file of reads with fake names")
+    parser.add_argument("fastq", help="output FASTQ file of reads with fake qualities")
+    args = parser.parse_args()
+
+    if args.reads == "-":
+        sam_fh = sys.stdin
+    else:
+        sam_fh = open(args.reads, "r")
+
+    with open(args.fasta, "w") as fasta_fh:
+        with open(args.fastq, "w") as fastq_fh:
+            convert_reads(sam_fh, fasta_fh, fastq_fh)
+
+    sam_fh.close()
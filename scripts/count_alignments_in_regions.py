@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Append the number of alignments overlapping each region of a BED file to the
+region's line.
+
+Counts are the same as `samtools view -c alignments.bam chr:start-end` with the
+region's start and end taken as one-based coordinates, but the BAM is opened
+once and the alignments of each chromosome are read once. Regions are visited
+in order of start position with a window of active alignments that may overlap
+the current or later regions. Lines are written in their input order.
+"""
+import argparse
+import pysam
+import sys
+
+
+def get_alignment_end(read):
+    """
+    Return the end of the given alignment on the reference as used by samtools
+    to find overlapping alignments. Alignments without reference bases span one
+    base.
+    """
+    end = read.reference_end
+    if read.is_unmapped or end is None or end <= read.reference_start:
+        return read.reference_start + 1
+
+    return end
+
+
+def count_region_alignments(alignments, regions):
+    """
+    Return a list of the number of alignments in the given iterable of
+    (start, end) tuples sorted by position that overlap each region in the given
+    list of zero-based half-open (start, end) tuples sorted by start.
+
+    >>> count_region_alignments([(0, 10), (5, 20), (15, 16), (30, 40)], [(0, 5), (9, 15), (10, 12), (16, 31), (40, 50)])
+    [1, 2, 1, 2, 0]
+    """
+    alignments = iter(alignments)
+    next_alignment = next(alignments, None)
+    active = []
+    counts = []
+    for start, end in regions:
+        # Alignments that end before this region also end before all later
+        # regions.
+        active = [alignment for alignment in active if alignment[1] > start]
+
+        while next_alignment is not None and next_alignment[0] < end:
+            if next_alignment[1] > start:
+                active.append(next_alignment)
+            next_alignment = next(alignments, None)
+
+        counts.append(len([alignment for alignment in active if alignment[0] < end]))
+
+    return counts
+
+
+def count_alignments_in_regions(alignments_filename, regions_filename, output):
+    """
+    Write each line of the given BED file of regions to the given output with
+    the number of alignments in the given BAM overlapping the region appended.
+    """
+    lines = []
+    regions_by_chromosome = {}
+    with open(regions_filename, "r") as fh:
+        for line in fh:
+            line = line.strip(" \t\n")
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+
+            # Convert one-based region coordinates to zero-based half-open
+            # coordinates as samtools does.
+            region = (max(int(fields[1]) - 1, 0), int(fields[2]), len(lines))
+            regions_by_chromosome.setdefault(fields[0], []).append(region)
+            lines.append(line)
+
+    counts = [0] * len(lines)
+    bam = pysam.AlignmentFile(alignments_filename, "rb")
+    for chromosome, regions in regions_by_chromosome.items():
+        regions.sort()
+        if chromosome not in bam.references:
+            sys.stderr.write("Region on unknown reference %s\n" % chromosome)
+            continue
+
+        alignments = (
+            (read.reference_start, get_alignment_end(read))
+            for read in bam.fetch(chromosome, regions[0][0], max([end for start, end, index in regions]))
+        )
+        region_counts = count_region_alignments(alignments, [(start, end) for start, end, index in regions])
+        for (start, end, index), count in zip(regions, region_counts):
+            counts[index] = count
+
+    bam.close()
+
+    for line, count in zip(lines, counts):
+        output.write("%s\t%i\n" % (line, count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("alignments", help="coordinate-sorted and indexed BAM of alignments")
+    parser.add_argument("regions", help="BED file of regions to count alignments in")
+    args = parser.parse_args()
+
+    count_alignments_in_regions(args.alignments, args.regions, sys.stdout)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+"""
+Extract reads for many local assembly regions from a list of BAMs in a single
+pass, writing reads for each region to its own SAM file.
+
+This replaces calling `samtools view` once per BAM and per region. Each BAM (and
+its index) is opened once and regions are visited in coordinate order.
+
+Overlapping regions such as tiled assembly windows share a pool of reads.
+Reads are fetched once for the merged span of overlapping regions (up to a
+maximum span length) and sliced from the pool for each region.
+
+Reads for regions with more than a maximum coverage can be downsampled to cap
+the total bases per region at a multiple of the region's length, preferring the
+longest reads with the highest mapping quality.
+
+Tiled windows whose reads show no evidence of non-reference sequence can be
+screened out before assembly. Reads provide evidence for a window when their
+alignments have large insertions, deletions, or clipped ends in the window.
+"""
+import argparse
+import csv
+from io_admission import BandwidthLimiter, ReaderSlots, BGZF_BLOCK_SIZE, estimate_region_bytes
+import os
+import pysam
+import random
+import sys
+
+# Default maximum length of a merged span of overlapping regions whose reads are
+# pooled in memory.
+DEFAULT_MAX_POOL_SPAN = 500000
+
+# Default seed to break ties between reads of equal length and mapping quality
+# when downsampling.
+DEFAULT_DOWNSAMPLE_SEED = 1
+
+# Default minimum lengths of indels and clipped ends in read alignments that
+# are evidence of non-reference sequence.
+DEFAULT_MIN_EVENT_LENGTH = 50
+DEFAULT_MIN_CLIPPING = 500
+
+# CIGAR operations used to screen alignments.
+CIGAR_INSERTION = 1
+CIGAR_DELETION = 2
+CIGAR_SOFT_CLIP = 4
+CIGAR_HARD_CLIP = 5
+REFERENCE_CONSUMING_OPERATIONS = (0, 2, 3, 7, 8)
+
+PRESCREEN_COLUMNS = ("region", "reads", "evidence_reads", "eligible", "skipped")
+
+
+def get_region_name(chromosome, start, end):
+    """
+    Return the filesystem-safe name used by the local assembly rules for a
+    region.
+
+    >>> get_region_name("chr1", 100, 200)
+    'chr1-100-200'
+    """
+    return "%s-%s-%s" % (chromosome, start, end)
+
+
+def load_regions(regions_filename, chromosome=None):
+    """
+    Load regions from the given BED file, optionally limited to a single
+    chromosome, and return them as a list of (chromosome, start, end) tuples
+    sorted by chromosome and start position.
+    """
+    regions = set()
+    with open(regions_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip().split("\t")
+            if len(fields) < 3 or (chromosome is not None and fields[0] != chromosome):
+                continue
+
+            regions.add((fields[0], int(fields[1]), int(fields[2])))
+
+    return sorted(regions)
+
+
+def load_alignment_paths(alignments_filename):
+    """
+    Return the list of BAM paths in the given file of filenames in the order they
+    are listed.
+    """
+    with open(alignments_filename, "r") as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+def fetch_region_reads(bams, chromosome, start, end, mapping_quality, bandwidth_limiter=None):
+    """
+    Yield reads from each of the given BAMs overlapping the given region with at
+    least the given mapping quality. Reads are yielded in BAM order and then in
+    coordinate order within each BAM, matching the output of running `samtools
+    view` on each BAM in turn.
+
+    If a bandwidth limiter is given, the compressed bytes expected to be read
+    from each BAM are reserved from it before the BAM is read for the region.
+    The reservation is reconciled with the bytes actually read afterward.
+    """
+    for bam in bams:
+        if chromosome not in bam.references:
+            continue
+
+        if bandwidth_limiter is not None:
+            reserved_bytes = estimate_region_bytes(os.path.getsize(bam.filename), sum(bam.lengths), end - start)
+            bandwidth_limiter.consume(reserved_bytes)
+
+        # Regions are passed to samtools as "chrom:start-end" using the BED
+        # start directly, so samtools treats it as a 1-based position. Shift
+        # the start here to select exactly the same reads.
+        first_offset = None
+        for read in bam.fetch(chromosome, max(start - 1, 0), end):
+            if first_offset is None:
+                first_offset = bam.tell() >> 16
+
+            if read.mapping_quality >= mapping_quality:
+                yield read
+
+        if bandwidth_limiter is not None:
+            if first_offset is None:
+                bytes_read = BGZF_BLOCK_SIZE
+            else:
+                bytes_read = (bam.tell() >> 16) - first_offset + BGZF_BLOCK_SIZE
+
+            if bytes_read > reserved_bytes:
+                bandwidth_limiter.consume(bytes_read - reserved_bytes)
+            else:
+                bandwidth_limiter.refund(reserved_bytes - bytes_read)
+
+
+def get_read_pool_spans(regions, max_span=DEFAULT_MAX_POOL_SPAN):
+    """
+    Group the given sorted regions into spans of overlapping regions on the same
+    chromosome that are no longer than the given maximum span. Returns a list of
+    (chromosome, start, end, regions) tuples. Regions that do not overlap any
+    other region are returned in spans of their own.
+
+    >>> get_read_pool_spans([("chr1", 0, 100), ("chr1", 50, 150), ("chr1", 200, 300), ("chr2", 0, 100)])
+    [('chr1', 0, 150, [('chr1', 0, 100), ('chr1', 50, 150)]), ('chr1', 200, 300, [('chr1', 200, 300)]), ('chr2', 0, 100, [('chr2', 0, 100)])]
+    >>> get_read_pool_spans([("chr1", 0, 100), ("chr1", 50, 150)], max_span=120)
+    [('chr1', 0, 100, [('chr1', 0, 100)]), ('chr1', 50, 150, [('chr1', 50, 150)])]
+    """
+    spans = []
+    for chromosome, start, end in regions:
+        if len(spans) > 0:
+            span_chromosome, span_start, span_end, span_regions = spans[-1]
+            if span_chromosome == chromosome and start < span_end and max(end, span_end) - span_start <= max_span:
+                spans[-1] = (span_chromosome, span_start, max(end, span_end), span_regions + [(chromosome, start, end)])
+                continue
+
+        spans.append((chromosome, start, end, [(chromosome, start, end)]))
+
+    return spans
+
+
+def slice_read_pool(pool, start, end):
+    """
+    Yield reads from the given pool of (read, start, end) tuples that
+    `fetch_region_reads` would return for the given region in the order they
+    were pooled.
+    """
+    fetch_start = max(start - 1, 0)
+    for read, read_start, read_end in pool:
+        if read_start < end and read_end > fetch_start:
+            yield read
+
+
+def select_reads(read_stats, max_bases, random_generator):
+    """
+    Return the sorted indices of reads to keep from the given list of (length,
+    mapping quality) tuples such that the total bases kept do not exceed the
+    given maximum. Reads are chosen from longest to shortest and then from
+    highest to lowest mapping quality with remaining ties broken by the given
+    random number generator. At least one read is always kept.
+
+    >>> select_reads([(100, 60), (500, 20), (300, 60), (500, 60)], 900, random.Random(1))
+    [0, 2, 3]
+    >>> select_reads([(1000, 60), (10, 60)], 100, random.Random(1))
+    [0]
+    >>> select_reads([], 100, random.Random(1))
+    []
+    """
+    priorities = sorted([
+        (-length, -mapq, random_generator.random(), index)
+        for index, (length, mapq) in enumerate(read_stats)
+    ])
+
+    kept = []
+    total_bases = 0
+    for negative_length, negative_mapq, tie_breaker, index in priorities:
+        if total_bases - negative_length > max_bases and len(kept) > 0:
+            continue
+
+        kept.append(index)
+        total_bases -= negative_length
+
+    return sorted(kept)
+
+
+def downsample_region_reads(reads, region_name, length, max_coverage, seed=DEFAULT_DOWNSAMPLE_SEED):
+    """
+    Return the reads from the given list to keep for the given region when its
+    total bases are capped at the given multiple of the region's length in the
+    original order of the reads.
+    """
+    read_stats = [(read.query_length, read.mapping_quality) for read in reads]
+    kept = select_reads(read_stats, max_coverage * length, random.Random("%s-%s" % (seed, region_name)))
+    sys.stderr.write("Downsampled %s: kept %i reads, dropped %i reads\n" % (region_name, len(kept), len(reads) - len(kept)))
+
+    return [reads[index] for index in kept]
+
+
+def has_non_reference_evidence(cigar, reference_start, start, end, min_event_length=DEFAULT_MIN_EVENT_LENGTH,
+                               min_clipping=DEFAULT_MIN_CLIPPING):
+    """
+    Return True if the given CIGAR tuples of an alignment starting at the given
+    reference position have an insertion or deletion of at least the given
+    minimum event length or a clipped end of at least the given minimum length
+    in the given region.
+
+    >>> has_non_reference_evidence([(0, 100), (2, 60), (0, 100)], 0, 50, 150)
+    True
+    >>> has_non_reference_evidence([(0, 100), (2, 60), (0, 100)], 0, 200, 300)
+    False
+    >>> has_non_reference_evidence([(0, 100), (1, 10), (0, 100), (4, 600)], 1000, 1150, 1300)
+    True
+    >>> has_non_reference_evidence([(5, 600), (0, 100)], 1000, 500, 1000)
+    False
+    """
+    position = reference_start
+    for operation, length in cigar:
+        if operation in (CIGAR_SOFT_CLIP, CIGAR_HARD_CLIP):
+            if length >= min_clipping and start <= position < end:
+                return True
+        elif operation == CIGAR_INSERTION:
+            if length >= min_event_length and start <= position < end:
+                return True
+        elif operation == CIGAR_DELETION:
+            if length >= min_event_length and position < end and position + length > start:
+                return True
+
+        if operation in REFERENCE_CONSUMING_OPERATIONS:
+            position += length
+
+    return False
+
+
+def load_window_only_regions(provenance_filename):
+    """
+    Return the set of names of planned regions in the given provenance file of
+    plan_assembly_regions.py that only cover tiled windows and no candidates.
+    """
+    sources_by_region = {}
+    with open(provenance_filename, "r") as fh:
+        reader = csv.DictReader(fh, delimiter="\t")
+        for row in reader:
+            region_name = get_region_name(row["planned_chrom"], row["planned_start"], row["planned_end"])
+            sources_by_region.setdefault(region_name, set()).add(row["source"])
+
+    return set([region_name for region_name, sources in sources_by_region.items() if sources == set(["window"])])
+
+
+class RegionPrescreen(object):
+    """
+    Screen regions for reads with evidence of non-reference sequence and skip
+    eligible regions with fewer than the given minimum number of evidence reads.
+    """
+    def __init__(self, eligible_regions, min_evidence_reads, min_event_length=DEFAULT_MIN_EVENT_LENGTH,
+                 min_clipping=DEFAULT_MIN_CLIPPING):
+        self.eligible_regions = eligible_regions
+        self.min_evidence_reads = min_evidence_reads
+        self.min_event_length = min_event_length
+        self.min_clipping = min_clipping
+        self.records = []
+
+    def screen(self, region_name, start, end, reads):
+        """
+        Record the number of reads and evidence reads for the given region and
+        return True if the region should be skipped.
+        """
+        evidence_reads = 0
+        for read in reads:
+            if read.cigartuples and has_non_reference_evidence(read.cigartuples, read.reference_start, start, end,
+                                                               self.min_event_length, self.min_clipping):
+                evidence_reads += 1
+
+        eligible = region_name in self.eligible_regions
+        skipped = eligible and evidence_reads < self.min_evidence_reads
+        self.records.append((region_name, len(reads), evidence_reads, int(eligible), int(skipped)))
+
+        return skipped
+
+    def write(self, output_filename):
+        with open(output_filename, "w") as oh:
+            oh.write("%s\n" % "\t".join(PRESCREEN_COLUMNS))
+            for record in self.records:
+                oh.write("%s\t%i\t%i\t%i\t%i\n" % record)
+
+        sys.stderr.write(
+            "Prescreen skipped %i of %i eligible regions\n" % (
+                sum([record[4] for record in self.records]),
+                sum([record[3] for record in self.records])
+            )
+        )
+
+
+def extract_region_reads(alignments_filename, regions_filename, output_dir, mapping_quality, chromosome=None,
+                         lock_dir=None, max_readers=None, max_bytes_per_second=None, max_pool_span=DEFAULT_MAX_POOL_SPAN,
+                         max_coverage=0, downsample_seed=DEFAULT_DOWNSAMPLE_SEED, prescreen=None):
+    """
+    Write the reads for each region in the given BED file to
+    `{output_dir}/{chromosome}-{start}-{end}.sam` with the header of the first
+    BAM in the given list of alignments. Returns the list of files written.
+
+    If a lock directory is given, wait for one of the given maximum number of
+    reader slots before opening any BAMs and limit the bytes read per second
+    by all jobs sharing the lock directory.
+
+    Reads for overlapping regions are fetched once per merged span of at most
+    the given maximum length and sliced for each region.
+
+    If a maximum coverage is given, reads for each region are downsampled to at
+    most that multiple of the region's length in bases.
+
+    If a prescreen is given, all reads of each region are screened for evidence
+    of non-reference sequence before downsampling.
+    """
+    regions = load_regions(regions_filename, chromosome)
+
+    if lock_dir is not None:
+        reader_slots = ReaderSlots(lock_dir, max_readers)
+        bandwidth_limiter = BandwidthLimiter(lock_dir, max_bytes_per_second)
+    else:
+        reader_slots = None
+        bandwidth_limiter = None
+
+    if reader_slots is not None:
+        reader_slots.acquire()
+
+    bams = [pysam.AlignmentFile(path, "rb") for path in load_alignment_paths(alignments_filename)]
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    output_files = []
+    spans = get_read_pool_spans(regions, max_pool_span)
+    for span_chromosome, span_start, span_end, span_regions in spans:
+        if len(span_regions) > 1:
+            pool = [
+                (read, read.reference_start, read.reference_end or read.reference_start + 1)
+                for read in fetch_region_reads(bams, span_chromosome, span_start, span_end, mapping_quality, bandwidth_limiter)
+            ]
+        else:
+            pool = None
+
+        for region_chromosome, start, end in span_regions:
+            region_name = get_region_name(region_chromosome, start, end)
+            output_file = os.path.join(output_dir, "%s.sam" % region_name)
+            output_sam = pysam.AlignmentFile(output_file, "wh", template=bams[0])
+
+            if pool is not None:
+                reads = slice_read_pool(pool, start, end)
+            else:
+                reads = fetch_region_reads(bams, region_chromosome, start, end, mapping_quality, bandwidth_limiter)
+
+            if prescreen is not None:
+                reads = list(reads)
+                prescreen.screen(region_name, start, end, reads)
+
+            if max_coverage > 0:
+                reads = downsample_region_reads(list(reads), region_name, end - start, max_coverage, downsample_seed)
+
+            for read in reads:
+                output_sam.write(read)
+
+            output_sam.close()
+            output_files.append(output_file)
+
+    for bam in bams:
+        bam.close()
+
+    if reader_slots is not None:
+        reader_slots.release()
+
+    sys.stderr.write("Fetched reads for %i regions in %i spans\n" % (len(regions), len(spans)))
+
+    return output_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("alignments", help="text file with one absolute path to a BAM of raw read alignments per line")
+    parser.add_argument("regions", help="BED file of regions to extract reads for")
+    parser.add_argument("output_dir", help="directory to write one SAM file per region to")
+    parser.add_argument("output_list", help="text file listing the SAM files written for all regions")
+    parser.add_argument("--mapping_quality", type=int, default=0, help="minimum mapping quality of reads to extract")
+    parser.add_argument("--chromosome", help="only extract reads for regions on this chromosome")
+    parser.add_argument("--lock_dir", help="directory shared by all jobs reading BAMs to limit concurrent I/O")
+    parser.add_argument("--max_readers", type=int, default=0, help="maximum number of jobs reading BAMs at once (0 for no limit)")
+    parser.add_argument("--max_bytes_per_second", type=int, default=0, help="maximum aggregate bytes per second read from BAMs by all jobs (0 for no limit)")
+    parser.add_argument("--max_pool_span", type=int, default=DEFAULT_MAX_POOL_SPAN, help="maximum length of a span of overlapping regions whose reads are fetched once and shared (0 to fetch reads per region)")
+    parser.add_argument("--max_coverage", type=float, default=0, help="maximum total bases of reads per region as a multiple of the region's length (0 to keep all reads)")
+    parser.add_argument("--downsample_seed", type=int, default=DEFAULT_DOWNSAMPLE_SEED, help="seed to break ties between equally preferred reads when downsampling")
+    parser.add_argument("--prescreen", help="tab-delimited file to write the number of reads with evidence of non-reference sequence per region and whether the region should be skipped")
+    parser.add_argument("--provenance", help="provenance file from plan_assembly_regions.py used to find regions that only cover tiled windows and may be skipped")
+    parser.add_argument("--min_evidence_reads", type=int, default=0, help="minimum number of reads with evidence of non-reference sequence required to assemble a tiled window (0 to assemble all windows)")
+    parser.add_argument("--min_event_length", type=int, default=DEFAULT_MIN_EVENT_LENGTH, help="minimum length of an insertion or deletion in a read alignment to count as evidence")
+    parser.add_argument("--min_clipping", type=int, default=DEFAULT_MIN_CLIPPING, help="minimum length of a clipped alignment end to count as evidence")
+    args = parser.parse_args()
+
+    if args.prescreen:
+        if args.provenance and args.min_evidence_reads > 0:
+            eligible_regions = load_window_only_regions(args.provenance)
+        else:
+            eligible_regions = set()
+
+        prescreen = RegionPrescreen(eligible_regions, args.min_evidence_reads, args.min_event_length, args.min_clipping)
+    else:
+        prescreen = None
+
+    output_files = extract_region_reads(args.alignments, args.regions, args.output_dir, args.mapping_quality, args.chromosome,
+                                        args.lock_dir, args.max_readers, args.max_bytes_per_second, args.max_pool_span,
+                                        args.max_coverage, args.downsample_seed, prescreen)
+
+    if prescreen is not None:
+        prescreen.write(args.prescreen)
+
+    with open(args.output_list, "w") as oh:
+        for output_file in output_files:
+            oh.write("%s\n" % output_file)
+
+    sys.stderr.write("Extracted reads for %i regions\n" % len(output_files))
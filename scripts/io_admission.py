@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Admission control for jobs that read BAMs from shared storage.
+
+Jobs on any node that share a lock directory are limited to a maximum number of
+concurrent BAM readers and, optionally, a maximum aggregate read bandwidth in
+bytes per second. Jobs start immediately when a reader slot and bandwidth are
+available and only wait when other jobs hold them.
+
+Reader slots are a counting semaphore built from one lock file per slot. Locks
+are held with `flock`, so the kernel releases the slot of a job that is killed.
+Bandwidth is a token bucket whose state lives in a single file in the lock
+directory and is updated under an exclusive lock. The lock directory must be on
+a filesystem that supports `flock` across nodes (e.g., NFSv4) to limit I/O
+across a cluster instead of a single node.
+
+Commands can also be run with a reader slot from the shell.
+
+    io_admission.py --lock_dir .io_admission --max_readers 8 -- samtools view ...
+"""
+import argparse
+import errno
+import fcntl
+import os
+import random
+import subprocess
+import sys
+import time
+
+# Default time in seconds to wait before checking for a free reader slot again.
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Size of the largest BGZF block used to approximate bytes read from a BAM.
+BGZF_BLOCK_SIZE = 65536
+
+
+def estimate_region_bytes(file_size, reference_length, region_length):
+    """
+    Return the approximate compressed bytes read from a BAM of the given size
+    for a region of the given length, assuming alignments are spread evenly
+    across a reference of the given length. Every region reads at least one
+    BGZF block.
+
+    >>> estimate_region_bytes(3 * 10 ** 9, 3 * 10 ** 9, 60000)
+    125536
+    """
+    return int(file_size * (region_length / float(max(reference_length, 1)))) + BGZF_BLOCK_SIZE
+
+
+def _make_lock_dir(lock_dir):
+    try:
+        os.makedirs(lock_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class ReaderSlots(object):
+    """
+    Counting semaphore limiting the number of concurrent readers that share the
+    given lock directory.
+    """
+    def __init__(self, lock_dir, max_readers, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.lock_dir = lock_dir
+        self.max_readers = max_readers
+        self.poll_interval = poll_interval
+        self.slot_fh = None
+
+    def _try_slot(self, slot):
+        fh = open(os.path.join(self.lock_dir, "reader.%i.lock" % slot), "a")
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            fh.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+
+        return fh
+
+    def acquire(self):
+        """
+        Block until a reader slot is available and hold it.
+        """
+        if self.max_readers is None or self.max_readers <= 0:
+            return
+
+        _make_lock_dir(self.lock_dir)
+
+        while True:
+            # Try slots in a random order so waiting jobs don't all contend for
+            # the first slot.
+            slots = list(range(self.max_readers))
+            random.shuffle(slots)
+            for slot in slots:
+                self.slot_fh = self._try_slot(slot)
+                if self.slot_fh is not None:
+                    return
+
+            time.sleep(self.poll_interval * (0.5 + random.random()))
+
+    def release(self):
+        if self.slot_fh is not None:
+            fcntl.flock(self.slot_fh.fileno(), fcntl.LOCK_UN)
+            self.slot_fh.close()
+            self.slot_fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class BandwidthLimiter(object):
+    """
+    Token bucket limiting the aggregate bytes per second read by all jobs that
+    share the given lock directory. Each job reserves the bytes it reads and
+    sleeps until the bucket has refilled enough to cover them, so a single job
+    never waits unless the shared budget is exhausted.
+    """
+    def __init__(self, lock_dir, max_bytes_per_second, burst_seconds=1.0):
+        self.lock_dir = lock_dir
+        self.rate = max_bytes_per_second
+        self.capacity = max_bytes_per_second * burst_seconds if max_bytes_per_second else 0
+        self.state_filename = os.path.join(lock_dir, "bandwidth.state")
+
+    def consume(self, bytes_read):
+        """
+        Reserve the given number of bytes from the shared bucket and wait until
+        the reservation is covered.
+        """
+        if not self.rate or self.rate <= 0 or bytes_read <= 0:
+            return
+
+        tokens = self._update(-bytes_read)
+        if tokens < 0:
+            time.sleep(-tokens / float(self.rate))
+
+    def refund(self, bytes_unused):
+        """
+        Return the given number of reserved bytes that were not read to the
+        shared bucket.
+        """
+        if not self.rate or self.rate <= 0 or bytes_unused <= 0:
+            return
+
+        self._update(bytes_unused)
+
+    def _update(self, change):
+        """
+        Refill the shared bucket for the time since its last update, add the
+        given change in tokens, and return the new number of tokens.
+        """
+        _make_lock_dir(self.lock_dir)
+
+        with open(self.state_filename, "a+") as fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                state = fh.read().split()
+                now = time.time()
+
+                if len(state) == 2:
+                    tokens, last_time = float(state[0]), float(state[1])
+                    tokens = min(self.capacity, tokens + (now - last_time) * self.rate)
+                else:
+                    tokens = self.capacity
+
+                # Tokens may go negative to queue this reservation behind those
+                # already made by other jobs.
+                tokens = min(self.capacity, tokens + change)
+
+                fh.seek(0)
+                fh.truncate()
+                fh.write("%f\t%f\n" % (tokens, now))
+                fh.flush()
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+        return tokens
+
+
+def run_command(command, lock_dir, max_readers, max_bytes_per_second=None, bytes_to_read=0):
+    """
+    Run the given command once a reader slot and the requested bandwidth are
+    available. Returns the return code of the command.
+    """
+    with ReaderSlots(lock_dir, max_readers):
+        BandwidthLimiter(lock_dir, max_bytes_per_second).consume(bytes_to_read)
+        return subprocess.call(command)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="command to run once admitted")
+    parser.add_argument("--lock_dir", required=True, help="directory shared by all jobs to admit")
+    parser.add_argument("--max_readers", type=int, default=0, help="maximum number of concurrent readers (0 for no limit)")
+    parser.add_argument("--max_bytes_per_second", type=int, default=0, help="maximum aggregate bytes per second read by all jobs (0 for no limit)")
+    parser.add_argument("--bytes", type=int, default=0, help="number of bytes the command is expected to read")
+    args = parser.parse_args()
+
+    command = args.command
+    if len(command) > 0 and command[0] == "--":
+        command = command[1:]
+
+    if len(command) == 0:
+        parser.error("no command given to run")
+
+    sys.exit(run_command(command, args.lock_dir, args.max_readers, args.max_bytes_per_second, args.bytes))
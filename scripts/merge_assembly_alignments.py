@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Merge the per-region SAM alignments of local assemblies into a single sorted and
+left-aligned BAM.
+
+Region alignments are split into chunks that are converted, left-aligned, and
+sorted in parallel. The sorted chunks are then combined with a single k-way
+merge by `samtools merge`.
+
+Alignments are listed one per line either as the path to a SAM file or as the
+directory of a region store and the name of a region separated by a tab (see
+region_store.py). Entries from each store are read in the order they were
+stored.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+from region_store import RegionStore
+import shutil
+import subprocess
+import sys
+
+# Assembled contig names end with a subread-style suffix (e.g., "/0_1234")
+# that is removed prior to merging.
+CONTIG_SUFFIX = re.compile(r"/0_[0-9]+")
+
+# Name of the file with a region's alignments in a region store.
+ALIGNMENT_FILENAME = "consensus_reference_alignment.sam"
+
+
+def load_sources(alignments_filename):
+    """
+    Return a list of (store directory, region, offset, size) tuples for
+    alignments in region stores and (None, path, None, size) tuples for SAM
+    files listed in the given file. Store entries are sorted by store and
+    offset.
+    """
+    files = []
+    regions_by_store = {}
+    with open(alignments_filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 2:
+                regions_by_store.setdefault(fields[0], []).append(fields[1])
+            elif fields[0].strip():
+                files.append((None, fields[0].strip(), None, os.path.getsize(fields[0].strip())))
+
+    entries = []
+    for store_dir in sorted(regions_by_store.keys()):
+        index = RegionStore(store_dir).load_index()
+        for region in regions_by_store[store_dir]:
+            if region not in index:
+                raise Exception("Region %s is missing from store %s" % (region, store_dir))
+
+            offset, length, stored_time = index[region]
+            entries.append((store_dir, region, offset, length))
+
+    return files + sorted(entries, key=lambda entry: (entry[0], entry[2]))
+
+
+def split_into_chunks(sources, number_of_chunks):
+    """
+    Split the given sources into at most the given number of chunks with
+    approximately equal total size while preserving their order.
+
+    >>> split_into_chunks([], 2)
+    [[]]
+    >>> split_into_chunks([(None, "a", None, 1), (None, "b", None, 1)], 2)
+    [[(None, 'a', None, 1)], [(None, 'b', None, 1)]]
+    """
+    if len(sources) == 0:
+        return [[]]
+
+    sizes = [source[3] for source in sources]
+    chunk_size = max(sum(sizes) / float(number_of_chunks), 1)
+
+    chunks = [[]]
+    current_size = 0
+    for source, size in zip(sources, sizes):
+        if current_size >= chunk_size and len(chunks) < number_of_chunks:
+            chunks.append([])
+            current_size = 0
+
+        chunks[-1].append(source)
+        current_size += size
+
+    return chunks
+
+
+def iterate_source_lines(sources):
+    """
+    Yield lines of alignments from the given sources, keeping each store's data
+    file open while its entries are read.
+    """
+    store = None
+    data_fh = None
+    for store_dir, name, offset, size in sources:
+        if store_dir is None:
+            with open(name, "r") as fh:
+                for line in fh:
+                    yield line
+            continue
+
+        if store is None or store.store_dir != store_dir:
+            if data_fh is not None:
+                data_fh.close()
+
+            store = RegionStore(store_dir)
+            data_fh = open(store.data_filename, "rb")
+
+        alignments = store.read_entry(offset, size, data_fh).get(ALIGNMENT_FILENAME, b"").decode()
+        for line in alignments.splitlines(True):
+            yield line
+
+    if data_fh is not None:
+        data_fh.close()
+
+
+def sort_chunk(arguments):
+    """
+    Convert the alignments from the given sources to BAM, left-align indels, and
+    sort the result into the given output BAM.
+    """
+    sources, chromosome_lengths, reference, output, tmp_prefix = arguments
+
+    with open(os.devnull, "w") as devnull:
+        view = subprocess.Popen(["samtools", "view", "-Sbu", "-t", chromosome_lengths, "-"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        leftalign = subprocess.Popen(["bamleftalign", "-f", reference], stdin=view.stdout, stdout=subprocess.PIPE)
+        sort = subprocess.Popen(["samtools", "sort", "-O", "bam", "-T", tmp_prefix, "-o", output], stdin=leftalign.stdout, stdout=devnull)
+        view.stdout.close()
+        leftalign.stdout.close()
+
+        for line in iterate_source_lines(sources):
+            view.stdin.write(CONTIG_SUFFIX.sub("", line, count=1).encode())
+
+        view.stdin.close()
+        return_codes = (view.wait(), leftalign.wait(), sort.wait())
+
+    if any(return_codes):
+        raise Exception("Failed to sort alignments into %s: %s" % (output, return_codes))
+
+    return output
+
+
+def merge_assembly_alignments(sources, chromosome_lengths, reference, output, threads, tmp_dir):
+    """
+    Merge the given per-region alignments into a single sorted BAM using the
+    given number of parallel processes.
+    """
+    chunk_dir = os.path.join(tmp_dir, "%s.chunks.%s" % (os.path.basename(output), os.getpid()))
+    if not os.path.isdir(chunk_dir):
+        os.makedirs(chunk_dir)
+
+    # Use more chunks than processes to balance uneven chunks across them.
+    chunks = split_into_chunks(sources, threads * 4)
+    tasks = [
+        (chunk, chromosome_lengths, reference, os.path.join(chunk_dir, "%i.bam" % i), os.path.join(chunk_dir, "%i.tmp" % i))
+        for i, chunk in enumerate(chunks)
+    ]
+
+    pool = multiprocessing.Pool(threads)
+    try:
+        chunk_bams = pool.map(sort_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    if len(chunk_bams) == 1:
+        shutil.move(chunk_bams[0], output)
+        return_code = 0
+    else:
+        return_code = subprocess.call(["samtools", "merge", "-f", "-@", str(threads), output] + chunk_bams)
+
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    return return_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("alignments", help="text file with one path to a SAM file or one region store directory and region of local assembly alignments per line")
+    parser.add_argument("chromosome_lengths", help="tab-delimited file of reference sequence names and lengths (e.g., .fai)")
+    parser.add_argument("reference", help="FASTA file of the reference used to align local assemblies")
+    parser.add_argument("output", help="sorted BAM of all local assembly alignments")
+    parser.add_argument("--threads", type=int, default=1, help="number of processes to use")
+    parser.add_argument("--tmp_dir", default=".", help="directory for sorted chunks of alignments")
+    args = parser.parse_args()
+
+    sys.exit(merge_assembly_alignments(load_sources(args.alignments), args.chromosome_lengths, args.reference, args.output, args.threads, args.tmp_dir))
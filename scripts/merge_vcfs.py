@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Merge VCFs of different variant types into a single VCF sorted by contig in the
+order of a reference index and by position within each contig.
+
+Headers are combined from the meta-information lines of the first VCF, the
+unique INFO lines of all VCFs, and the first column header line. Records of each
+contig are merged from all VCFs in one pass. Contigs listed in more than one
+block of a VCF or with unsorted positions are loaded and sorted in memory. VCFs
+with names ending in `.gz` are compressed with bgzip as they are written and
+indexed with tabix.
+"""
+import argparse
+import heapq
+import subprocess
+import sys
+
+# Column header line used when none of the VCFs have one.
+DEFAULT_COLUMN_HEADER = b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def read_contig_order(fai_filename):
+    """
+    Return a list of contig names in the order of the given FASTA index.
+    """
+    with open(fai_filename, "rb") as fh:
+        return [line.split(b"\t")[0] for line in fh if line.strip()]
+
+
+def get_position(line):
+    return int(line.split(b"\t", 2)[1])
+
+
+class VcfRecords(object):
+    """
+    Index the header and record blocks of each contig in a VCF with one pass
+    over the file and return sorted records per contig.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = []
+        self.blocks = {}
+        self.unordered = set()
+
+        contig = None
+        previous_position = None
+        offset = 0
+        with open(filename, "rb") as fh:
+            for line in fh:
+                if line.startswith(b"#"):
+                    self.header.append(line)
+                elif line.strip():
+                    fields = line.split(b"\t", 2)
+                    position = int(fields[1])
+                    if fields[0] != contig:
+                        contig = fields[0]
+                        if contig in self.blocks:
+                            self.unordered.add(contig)
+                        self.blocks.setdefault(contig, []).append([offset, offset])
+                    elif position < previous_position:
+                        self.unordered.add(contig)
+
+                    previous_position = position
+                    self.blocks[contig][-1][1] = offset + len(line)
+
+                offset += len(line)
+
+    def fetch(self, contig):
+        """
+        Yield records of the given contig sorted by position.
+        """
+        if contig not in self.blocks:
+            return
+
+        with open(self.filename, "rb") as fh:
+            if contig in self.unordered:
+                lines = []
+                for start, end in self.blocks[contig]:
+                    lines.extend(self._read_block(fh, start, end))
+
+                for line in sorted(lines, key=get_position):
+                    yield line
+            else:
+                start, end = self.blocks[contig][0]
+                for line in self._read_block(fh, start, end):
+                    yield line
+
+    def _read_block(self, fh, start, end):
+        fh.seek(start)
+        offset = start
+        while offset < end:
+            line = fh.readline()
+            offset += len(line)
+            if line.strip() and not line.startswith(b"#"):
+                yield line
+
+
+def merge_headers(vcfs):
+    """
+    Return header lines with meta-information of the first VCF, the sorted
+    unique INFO lines of all VCFs, and the first column header line.
+    """
+    info = set()
+    column_header = None
+    for vcf in vcfs:
+        for line in vcf.header:
+            if line.startswith(b"##") and b"INFO" in line:
+                info.add(line)
+            elif line.startswith(b"#CHROM") and column_header is None:
+                column_header = line
+
+    header = [line for line in vcfs[0].header if line.startswith(b"##") and b"INFO" not in line]
+    header.extend(sorted(info))
+    header.append(column_header or DEFAULT_COLUMN_HEADER)
+    return header
+
+
+def merge_records(vcfs, contigs):
+    """
+    Yield records of all VCFs merged by the given contig order and position.
+    Records on contigs missing from the given order follow in sorted order of
+    contig name.
+    """
+    known_contigs = set(contigs)
+    extra_contigs = set()
+    for vcf in vcfs:
+        extra_contigs.update([contig for contig in vcf.blocks if contig not in known_contigs])
+
+    if len(extra_contigs) > 0:
+        sys.stderr.write("Found %i contigs missing from the reference index\n" % len(extra_contigs))
+
+    for contig in list(contigs) + sorted(extra_contigs):
+        streams = [
+            ((get_position(line), i, j, line) for j, line in enumerate(vcf.fetch(contig)))
+            for i, vcf in enumerate(vcfs)
+        ]
+        for position, i, j, line in heapq.merge(*streams):
+            yield line
+
+
+def merge_vcfs(vcf_filenames, fai_filename, output_filename):
+    vcfs = [VcfRecords(filename) for filename in vcf_filenames]
+    contigs = read_contig_order(fai_filename)
+
+    compress = output_filename.endswith(".gz")
+    if compress:
+        output_fh = open(output_filename, "wb")
+        bgzip = subprocess.Popen(["bgzip", "-c"], stdin=subprocess.PIPE, stdout=output_fh)
+        oh = bgzip.stdin
+    else:
+        oh = open(output_filename, "wb")
+
+    records = 0
+    oh.writelines(merge_headers(vcfs))
+    for line in merge_records(vcfs, contigs):
+        oh.write(line)
+        records += 1
+
+    oh.close()
+    if compress:
+        return_code = bgzip.wait()
+        output_fh.close()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, "bgzip -c")
+
+        subprocess.check_call(["tabix", "-p", "vcf", output_filename])
+
+    sys.stderr.write("Merged %i records from %i VCFs\n" % (records, len(vcfs)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reference_index", help="FASTA index (.fai) of the reference with contigs in output order")
+    parser.add_argument("output", help="merged VCF; compressed with bgzip and indexed with tabix if it ends in .gz")
+    parser.add_argument("vcfs", nargs="+", help="VCFs to merge")
+    args = parser.parse_args()
+
+    merge_vcfs(args.vcfs, args.reference_index, args.output)
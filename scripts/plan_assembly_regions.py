@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Plan regions for local assembly from signature-based candidates and tiled
+windows without assembling the same locus more than once.
+
+A region is dropped when another planned region covers at least the given
+fraction of its length. The covering region is extended to span the bases of
+the dropped region it does not cover, so every input base is still assembled.
+Extensions are limited to the uncovered fraction of the covering region's
+original length, so partially overlapping regions do not chain into one large
+region. Regions that would extend a covering region past that limit are
+planned as is.
+Regions are considered from longest to shortest, so
+contained regions are dropped in favor of the regions that contain them and
+regions with identical coordinates are planned once. Candidates are preferred
+over windows of the same length.
+
+Every input region is written to a provenance file with its source and the
+planned region that covers it, so candidate regions can be traced to the
+assemblies that span them.
+"""
+import argparse
+import bisect
+import sys
+
+PROVENANCE_COLUMNS = ("chrom", "start", "end", "source", "planned_chrom", "planned_start", "planned_end")
+
+
+def load_regions(filename, source):
+    """
+    Return a list of (chromosome, start, end, source) tuples for the regions in
+    the given BED file.
+    """
+    regions = []
+    with open(filename, "r") as fh:
+        for line in fh:
+            fields = line.rstrip().split("\t")
+            if len(fields) < 3:
+                continue
+
+            regions.append((fields[0], int(fields[1]), int(fields[2]), source))
+
+    return regions
+
+
+def plan_regions(regions, min_covered_fraction=1.0):
+    """
+    Return a dictionary of planned (chromosome, start, end) regions by input
+    region for the given list of (chromosome, start, end, source) regions.
+    Regions that are not covered by any other planned region by at least the
+    given fraction of their length are planned as is. Planned regions that
+    cover only part of a dropped region are extended to its end as long as they
+    grow by at most one minus the given fraction of their original length.
+
+    >>> regions = [("chr1", 0, 100, "window"), ("chr1", 10, 50, "candidate"), ("chr1", 90, 200, "candidate"), ("chr1", 10, 50, "window")]
+    >>> plan = plan_regions(regions)
+    >>> [(region[1], region[2], region[3], plan[region][1:]) for region in regions]
+    [(0, 100, 'window', (0, 100)), (10, 50, 'candidate', (0, 100)), (90, 200, 'candidate', (90, 200)), (10, 50, 'window', (0, 100))]
+    >>> plan = plan_regions([("chr1", 0, 100, "window"), ("chr1", 5, 102, "candidate"), ("chr1", 90, 100, "candidate")], 0.9)
+    >>> sorted(plan.items())
+    [(('chr1', 0, 100, 'window'), ('chr1', 0, 102)), (('chr1', 5, 102, 'candidate'), ('chr1', 0, 102)), (('chr1', 90, 100, 'candidate'), ('chr1', 0, 102))]
+    >>> plan = plan_regions([("chr1", 0, 100, "window"), ("chr1", 3, 102, "candidate"), ("chr1", 7, 106, "candidate")], 0.95)
+    >>> plan[("chr1", 3, 102, "candidate")], plan[("chr1", 7, 106, "candidate")]
+    (('chr1', 0, 102), ('chr1', 7, 106))
+    """
+    # Planned regions per chromosome as a sorted list of (start, end, index)
+    # with the length of the longest planned region for range queries by
+    # start. Input regions map to the index of their planned region, so
+    # regions mapped to a planned region that is extended later follow it.
+    planned_by_chromosome = {}
+    max_length_by_chromosome = {}
+    planned_regions = []
+    max_planned_lengths = []
+    plan = {}
+
+    source_order = {"candidate": 0, "window": 1}
+    for region in sorted(set(regions), key=lambda region: (region[1] - region[2], source_order.get(region[3], 2), region)):
+        chromosome, start, end, source = region
+        length = end - start
+        planned = planned_by_chromosome.setdefault(chromosome, [])
+
+        # Find the planned region that covers the most of this region among
+        # planned regions that can overlap it.
+        best_overlap = 0
+        best_region = None
+        first = bisect.bisect_left(planned, (start - max_length_by_chromosome.get(chromosome, 0),))
+        last = bisect.bisect_left(planned, (end,))
+        for planned_region in planned[first:last]:
+            overlap = min(end, planned_region[1]) - max(start, planned_region[0])
+            if overlap > best_overlap:
+                best_overlap = overlap
+                best_region = planned_region
+
+        covered = False
+        if best_region is not None and best_overlap >= min_covered_fraction * length:
+            planned_start, planned_end, index = best_region
+            covered = max(end, planned_end) - min(start, planned_start) <= max_planned_lengths[index]
+
+        if covered:
+            if start < planned_start or end > planned_end:
+                planned.pop(bisect.bisect_left(planned, best_region))
+                planned_start, planned_end = min(start, planned_start), max(end, planned_end)
+                bisect.insort(planned, (planned_start, planned_end, index))
+                max_length_by_chromosome[chromosome] = max(max_length_by_chromosome[chromosome], planned_end - planned_start)
+                planned_regions[index] = (chromosome, planned_start, planned_end)
+
+            plan[region] = index
+        else:
+            bisect.insort(planned, (start, end, len(planned_regions)))
+            max_length_by_chromosome[chromosome] = max(max_length_by_chromosome.get(chromosome, 0), length)
+            plan[region] = len(planned_regions)
+            planned_regions.append((chromosome, start, end))
+            max_planned_lengths.append(int(length * (2 - min_covered_fraction)))
+
+    return dict([(region, planned_regions[index]) for region, index in plan.items()])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("candidates", help="BED file of signature-based assembly candidates")
+    parser.add_argument("windows", help="BED file of tiled assembly windows")
+    parser.add_argument("output", help="sorted BED file of regions to assemble")
+    parser.add_argument("provenance", help="tab-delimited file of each input region's source and the planned region that covers it")
+    parser.add_argument("--min_covered_fraction", type=float, default=1.0, help="minimum fraction of a region covered by another planned region to drop it")
+    args = parser.parse_args()
+
+    if not 0 < args.min_covered_fraction <= 1:
+        parser.error("--min_covered_fraction must be greater than 0 and at most 1")
+
+    regions = load_regions(args.candidates, "candidate") + load_regions(args.windows, "window")
+    plan = plan_regions(regions, args.min_covered_fraction)
+    planned_regions = sorted(set(plan.values()))
+
+    with open(args.output, "w") as oh:
+        for chromosome, start, end in planned_regions:
+            oh.write("%s\t%i\t%i\n" % (chromosome, start, end))
+
+    with open(args.provenance, "w") as oh:
+        oh.write("%s\n" % "\t".join(PROVENANCE_COLUMNS))
+        for region in sorted(regions):
+            oh.write("%s\t%i\t%i\t%s\t%s\t%i\t%i\n" % (region + plan[region]))
+
+    total_bases = sum([end - start for chromosome, start, end, source in regions])
+    planned_bases = sum([end - start for chromosome, start, end in planned_regions])
+    sys.stderr.write(
+        "Planned %i of %i regions (%i bases of %i); saved %i redundant assemblies of %i bases\n" % (
+            len(planned_regions),
+            len(regions),
+            planned_bases,
+            total_bases,
+            len(regions) - len(planned_regions),
+            total_bases - planned_bases
+        )
+    )
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Append-only indexed store of per-region local assembly outputs.
+
+Each chromosome's assembly directory holds one store in place of one directory
+per region. A store consists of a data file of concatenated gzip members, one
+member per entry holding a tar archive of a region's output files, and a
+tab-delimited index of each entry's region, offset, compressed length, and time
+stored. Because each entry is a complete gzip member, the data file can also be
+read with standard tools (e.g., `zcat regions.gz | tar -xi`).
+
+Jobs add entries under an exclusive lock. Adding a region that is already in
+the store appends a new entry that replaces the earlier one when the index is
+loaded. Superseded entries can be removed with the `compact` command.
+"""
+import argparse
+import errno
+import fcntl
+import gzip
+import io
+import os
+import sys
+import tarfile
+import time
+
+DATA_FILENAME = "regions.gz"
+INDEX_FILENAME = "regions.index"
+LOCK_FILENAME = "regions.lock"
+
+
+class RegionStore(object):
+    """
+    Store of region outputs in the given directory.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.data_filename = os.path.join(store_dir, DATA_FILENAME)
+        self.index_filename = os.path.join(store_dir, INDEX_FILENAME)
+        self.lock_filename = os.path.join(store_dir, LOCK_FILENAME)
+
+    def _lock(self):
+        try:
+            os.makedirs(self.store_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        lock = open(self.lock_filename, "a")
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return lock
+
+    def _unlock(self, lock):
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        lock.close()
+
+    def add(self, region, filenames):
+        """
+        Append an entry with the given files for the given region to the store.
+        Files are stored by their base names.
+        """
+        archive = io.BytesIO()
+        tar = tarfile.open(fileobj=archive, mode="w")
+        for filename in filenames:
+            tar.add(filename, arcname=os.path.basename(filename))
+        tar.close()
+
+        data = io.BytesIO()
+        gz = gzip.GzipFile(fileobj=data, mode="wb")
+        gz.write(archive.getvalue())
+        gz.close()
+        data = data.getvalue()
+
+        lock = self._lock()
+        try:
+            with open(self.data_filename, "ab") as oh:
+                oh.seek(0, os.SEEK_END)
+                offset = oh.tell()
+                oh.write(data)
+                oh.flush()
+                os.fsync(oh.fileno())
+
+            # Index the entry only after its data is complete so readers never
+            # see a partial entry.
+            with open(self.index_filename, "a") as oh:
+                oh.write("%s\t%i\t%i\t%.3f\n" % (region, offset, len(data), time.time()))
+                oh.flush()
+                os.fsync(oh.fileno())
+        finally:
+            self._unlock(lock)
+
+    def load_index(self):
+        """
+        Return a dictionary of (offset, length, time stored) by region for the
+        latest entry of each region in the store.
+        """
+        index = {}
+        if not os.path.exists(self.index_filename):
+            return index
+
+        with open(self.index_filename, "r") as fh:
+            for line in fh:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 4:
+                    continue
+
+                index[fields[0]] = (int(fields[1]), int(fields[2]), float(fields[3]))
+
+        return index
+
+    def read_entry(self, offset, length, fh=None):
+        """
+        Return a dictionary of file contents by file name for the entry at the
+        given offset and length, optionally reading from the given open handle
+        of the data file.
+        """
+        if fh is None:
+            with open(self.data_filename, "rb") as fh:
+                return self.read_entry(offset, length, fh)
+
+        fh.seek(offset)
+        tar = tarfile.open(fileobj=io.BytesIO(fh.read(length)), mode="r:gz")
+        files = {}
+        for member in tar.getmembers():
+            files[member.name] = tar.extractfile(member).read()
+        tar.close()
+
+        return files
+
+    def get(self, region):
+        """
+        Return a dictionary of file contents by file name for the latest entry
+        of the given region or None if the region is not in the store.
+        """
+        index = self.load_index()
+        if region not in index:
+            return None
+
+        offset, length, stored_time = index[region]
+        return self.read_entry(offset, length)
+
+    def find(self, filename, text):
+        """
+        Return the regions whose latest entry has a file with the given name
+        containing the given text, reading entries in the order they were
+        stored.
+        """
+        index = self.load_index()
+        entries = sorted([(offset, length, region) for region, (offset, length, stored_time) in index.items()])
+        text = text.encode()
+
+        regions = []
+        if len(entries) == 0:
+            return regions
+
+        with open(self.data_filename, "rb") as fh:
+            for offset, length, region in entries:
+                if text in self.read_entry(offset, length, fh).get(filename, b""):
+                    regions.append(region)
+
+        return regions
+
+    def compact(self):
+        """
+        Rewrite the store with only the latest entry of each region and return
+        the number of entries removed.
+        """
+        lock = self._lock()
+        try:
+            if not os.path.exists(self.index_filename):
+                return 0
+
+            with open(self.index_filename, "r") as fh:
+                total_entries = len([line for line in fh if line.strip()])
+
+            index = self.load_index()
+            entries = sorted([(offset, length, stored_time, region) for region, (offset, length, stored_time) in index.items()])
+
+            tmp_data_filename = "%s.tmp" % self.data_filename
+            tmp_index_filename = "%s.tmp" % self.index_filename
+            with open(self.data_filename, "rb") as fh:
+                with open(tmp_data_filename, "wb") as data_oh:
+                    with open(tmp_index_filename, "w") as index_oh:
+                        for offset, length, stored_time, region in entries:
+                            fh.seek(offset)
+                            index_oh.write("%s\t%i\t%i\t%.3f\n" % (region, data_oh.tell(), length, stored_time))
+                            data_oh.write(fh.read(length))
+
+            os.rename(tmp_data_filename, self.data_filename)
+            os.rename(tmp_index_filename, self.index_filename)
+        finally:
+            self._unlock(lock)
+
+        return total_entries - len(entries)
+
+
+def add(args):
+    RegionStore(args.store_dir).add(args.region, args.files)
+    return 0
+
+
+def get(args):
+    files = RegionStore(args.store_dir).get(args.region)
+    if files is None or args.filename not in files:
+        sys.stderr.write("No %s for %s in %s\n" % (args.filename, args.region, args.store_dir))
+        return 1
+
+    if hasattr(sys.stdout, "buffer"):
+        sys.stdout.buffer.write(files[args.filename])
+    else:
+        sys.stdout.write(files[args.filename])
+
+    return 0
+
+
+def list_regions(args):
+    for region, (offset, length, stored_time) in sorted(RegionStore(args.store_dir).load_index().items(), key=lambda item: item[1][0]):
+        sys.stdout.write("%s\t%i\t%i\t%.3f\n" % (region, offset, length, stored_time))
+
+    return 0
+
+
+def find(args):
+    for region in RegionStore(args.store_dir).find(args.filename, args.text):
+        sys.stdout.write("%s\n" % region)
+
+    return 0
+
+
+def compact(args):
+    removed = RegionStore(args.store_dir).compact()
+    sys.stderr.write("Removed %i superseded entries\n" % removed)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_add = subparsers.add_parser("add", help="add or replace the files of a region in the store")
+    parser_add.add_argument("store_dir", help="directory of the store")
+    parser_add.add_argument("region", help="region in the form of chrom-start-end")
+    parser_add.add_argument("files", nargs="+", help="files to store for the region")
+    parser_add.set_defaults(func=add)
+
+    parser_get = subparsers.add_parser("get", help="write a file of a region to standard output")
+    parser_get.add_argument("store_dir", help="directory of the store")
+    parser_get.add_argument("region", help="region in the form of chrom-start-end")
+    parser_get.add_argument("filename", help="name of the file to get")
+    parser_get.set_defaults(func=get)
+
+    parser_list = subparsers.add_parser("list", help="list the latest entry of each region in the store")
+    parser_list.add_argument("store_dir", help="directory of the store")
+    parser_list.set_defaults(func=list_regions)
+
+    parser_find = subparsers.add_parser("find", help="list regions whose latest entry has a file containing the given text")
+    parser_find.add_argument("store_dir", help="directory of the store")
+    parser_find.add_argument("filename", help="name of the file to search")
+    parser_find.add_argument("text", help="text to search for")
+    parser_find.set_defaults(func=find)
+
+    parser_compact = subparsers.add_parser("compact", help="remove superseded entries from the store")
+    parser_compact.add_argument("store_dir", help="directory of the store")
+    parser_compact.set_defaults(func=compact)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+"""
+Node-local scratch space for jobs with capacity reservations, shared read-only
+inputs, and cleanup of directories left behind by killed jobs.
+
+Each job reserves the scratch space it expects to use before it starts and
+waits while other jobs on the node have reserved the free space. Free space is
+the space available on the scratch filesystem minus every live job's
+reservation and the size of any inputs it is staging, as recorded with the job.
+Reservations count in full even after a job writes to its directory, so space
+checks never walk job directories and never overcommit the filesystem.
+
+Read-only inputs such as the reference and its indices are staged once per node
+and shared by all jobs that need them. Inputs are copied without holding the
+node's lock into a temporary directory owned by the staging job and renamed
+into place when the copy finishes. Each job holding a staged input adds a
+reference to it. Inputs without references stay staged for later jobs until
+their space is needed for a new reservation.
+
+Jobs record their host and owner process ID. Directories and references of jobs
+whose owner process no longer exists on this host are removed the next time any
+job reserves space or when the `gc` command runs.
+
+Commands can be run in a scratch directory from the shell with inputs staged in
+environment variables.
+
+    scratch.py run /var/tmp align_0 --reserve_gb 20 --stage REFERENCE=ref.fa,ref.fa.fai -- blasr ... $REFERENCE
+"""
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+# Name of the directory under the scratch root managed by this module.
+SCRATCH_DIRNAME = "smrtsv_scratch"
+
+# Default time in seconds to wait before checking for free space again.
+DEFAULT_POLL_INTERVAL = 10.0
+
+GIGABYTE = 1024 ** 3
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+
+class ScratchSpace(object):
+    """
+    Scratch space under the given root directory shared by all jobs on a node.
+    """
+    def __init__(self, root, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.join(os.path.abspath(root), SCRATCH_DIRNAME)
+        self.jobs_dir = os.path.join(self.root, "jobs")
+        self.shared_dir = os.path.join(self.root, "shared")
+        self.lock_filename = os.path.join(self.root, "scratch.lock")
+        self.poll_interval = poll_interval
+        self.host = socket.gethostname()
+
+        _makedirs(self.jobs_dir)
+        _makedirs(self.shared_dir)
+
+    def _lock(self):
+        lock = open(self.lock_filename, "a")
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return lock
+
+    def _unlock(self, lock):
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        lock.close()
+
+    def _get_job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _load_jobs(self):
+        """
+        Return a dictionary of job metadata by job ID for all jobs with
+        scratch directories.
+        """
+        jobs = {}
+        for filename in os.listdir(self.jobs_dir):
+            if not filename.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self.jobs_dir, filename), "r") as fh:
+                    jobs[filename[:-len(".json")]] = json.load(fh)
+            except (IOError, ValueError):
+                continue
+
+        return jobs
+
+    def _write_job(self, job_id, job):
+        with open(os.path.join(self.jobs_dir, "%s.json" % job_id), "w") as oh:
+            json.dump(job, oh)
+
+    def _set_staging_size(self, job_id, staging_bytes):
+        """
+        Record the number of bytes the given job is staging. Must be called
+        with the lock held.
+        """
+        job = self._load_jobs()[job_id]
+        job["staging"] = staging_bytes
+        self._write_job(job_id, job)
+
+    def _get_staged_inputs(self):
+        """
+        Return a list of (last used time, key, number of references) for all
+        staged inputs.
+        """
+        staged_inputs = []
+        for key in os.listdir(self.shared_dir):
+            entry_dir = os.path.join(self.shared_dir, key)
+            if key.endswith(".refs") or ".tmp." in key or not os.path.isdir(entry_dir):
+                continue
+
+            refs_dir = "%s.refs" % entry_dir
+            references = len(os.listdir(refs_dir)) if os.path.isdir(refs_dir) else 0
+            staged_inputs.append((os.path.getmtime(entry_dir), key, references))
+
+        return staged_inputs
+
+    def _remove_job(self, job_id):
+        shutil.rmtree(self._get_job_dir(job_id), ignore_errors=True)
+
+        for key in os.listdir(self.shared_dir):
+            if key.endswith(".refs"):
+                try:
+                    os.remove(os.path.join(self.shared_dir, key, job_id))
+                except OSError:
+                    pass
+
+        try:
+            os.remove(os.path.join(self.jobs_dir, "%s.json" % job_id))
+        except OSError:
+            pass
+
+    def _collect_garbage(self):
+        """
+        Remove scratch directories and references of jobs on this host whose
+        owner processes no longer exist and inputs they were staging. Returns
+        the number of jobs removed. Must be called with the lock held.
+        """
+        removed = 0
+        for job_id, job in self._load_jobs().items():
+            if job["host"] == self.host and not _is_alive(job["pid"]):
+                self._remove_job(job_id)
+                removed += 1
+
+        # Temporary staging directories are named by the job staging them and
+        # are only removed once that job is gone.
+        jobs = self._load_jobs()
+        for key in os.listdir(self.shared_dir):
+            if ".tmp." in key and key.split(".tmp.", 1)[1] not in jobs:
+                shutil.rmtree(os.path.join(self.shared_dir, key), ignore_errors=True)
+
+        return removed
+
+    def _get_free_space(self):
+        """
+        Return the bytes available on the scratch filesystem minus each live
+        job's reservation and the inputs it is staging. Must be called with the
+        lock held.
+        """
+        stats = os.statvfs(self.root)
+        free_space = stats.f_bavail * stats.f_frsize
+
+        for job in self._load_jobs().values():
+            free_space -= job["reserved"] + job.get("staging", 0)
+
+        return free_space
+
+    def _evict_unreferenced_inputs(self, needed):
+        """
+        Remove the least recently used staged inputs without references until
+        the given number of bytes are free or no more inputs can be removed.
+        Must be called with the lock held.
+        """
+        for last_used, key, references in sorted(self._get_staged_inputs()):
+            if self._get_free_space() >= needed:
+                break
+
+            if references == 0:
+                entry_dir = os.path.join(self.shared_dir, key)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                shutil.rmtree("%s.refs" % entry_dir, ignore_errors=True)
+
+    def _wait_for_space(self, needed, description):
+        """
+        Acquire the lock once the given number of bytes are free and return the
+        held lock.
+        """
+        waiting = False
+        while True:
+            lock = self._lock()
+            self._collect_garbage()
+            if self._get_free_space() < needed:
+                self._evict_unreferenced_inputs(needed)
+
+            if self._get_free_space() >= needed:
+                return lock
+
+            self._unlock(lock)
+            if not waiting:
+                sys.stderr.write("Waiting for %.2f GB of scratch space for %s\n" % (needed / float(GIGABYTE), description))
+                waiting = True
+
+            time.sleep(self.poll_interval)
+
+    def reserve(self, name, reserved_bytes, pid=None):
+        """
+        Wait until the given number of bytes are free, create a scratch
+        directory for a job with the given name owned by the given process, and
+        return the job's ID.
+        """
+        if pid is None:
+            pid = os.getpid()
+
+        job_id = "%s.%s.%i" % (name, self.host, pid)
+        lock = self._wait_for_space(reserved_bytes, job_id)
+        try:
+            _makedirs(self._get_job_dir(job_id))
+            self._write_job(job_id, {"host": self.host, "pid": pid, "reserved": reserved_bytes, "staging": 0, "created": time.time()})
+        finally:
+            self._unlock(lock)
+
+        return job_id
+
+    def get_job_dir(self, job_id):
+        return self._get_job_dir(job_id)
+
+    def stage(self, job_id, filenames):
+        """
+        Stage the given read-only files together in the shared scratch space for
+        the given job and return the staged path of the first file. Files
+        already staged with the same paths, sizes, and modification times are
+        reused.
+        """
+        filenames = [os.path.realpath(filename) for filename in filenames]
+        digest = hashlib.sha1()
+        for filename in filenames:
+            stats = os.stat(filename)
+            digest.update(("%s\t%i\t%i\n" % (filename, stats.st_size, int(stats.st_mtime))).encode())
+
+        key = digest.hexdigest()
+        entry_dir = os.path.join(self.shared_dir, key)
+        staged_filename = os.path.join(entry_dir, os.path.basename(filenames[0]))
+
+        # Reserve space for the files and claim a temporary directory for them
+        # with the lock held. Files staged before the lock is acquired may have
+        # been evicted since, so space is reserved unless they are still staged
+        # once the lock is held.
+        staging_bytes = sum([os.path.getsize(filename) for filename in filenames])
+        lock = self._lock()
+        if not os.path.isdir(entry_dir):
+            self._unlock(lock)
+            lock = self._wait_for_space(staging_bytes, "staging %s" % filenames[0])
+
+        try:
+            # Another job may have staged the same files while this job waited.
+            if os.path.isdir(entry_dir):
+                self._add_reference(entry_dir, job_id)
+                return staged_filename
+
+            tmp_dir = "%s.tmp.%s" % (entry_dir, job_id)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            _makedirs(tmp_dir)
+            self._set_staging_size(job_id, staging_bytes)
+        finally:
+            self._unlock(lock)
+
+        # Copy files without the lock so other jobs on the node can reserve and
+        # release space in the meantime.
+        try:
+            for filename in filenames:
+                shutil.copy2(filename, tmp_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            lock = self._lock()
+            try:
+                self._set_staging_size(job_id, 0)
+            finally:
+                self._unlock(lock)
+            raise
+
+        lock = self._lock()
+        try:
+            # Keep the files of another job that finished staging the same
+            # files first.
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            else:
+                os.rename(tmp_dir, entry_dir)
+
+            self._set_staging_size(job_id, 0)
+            self._add_reference(entry_dir, job_id)
+        finally:
+            self._unlock(lock)
+
+        return staged_filename
+
+    def _add_reference(self, entry_dir, job_id):
+        """
+        Add a reference from the given job to the given staged input and mark
+        the input as recently used. Must be called with the lock held.
+        """
+        refs_dir = "%s.refs" % entry_dir
+        _makedirs(refs_dir)
+        open(os.path.join(refs_dir, job_id), "w").close()
+
+        now = time.time()
+        os.utime(entry_dir, (now, now))
+
+    def release(self, job_id):
+        """
+        Remove the given job's scratch directory and its references to staged
+        inputs.
+        """
+        lock = self._lock()
+        try:
+            self._remove_job(job_id)
+        finally:
+            self._unlock(lock)
+
+    def collect_garbage(self):
+        lock = self._lock()
+        try:
+            return self._collect_garbage()
+        finally:
+            self._unlock(lock)
+
+
+def _parse_stage(stage):
+    """
+    Return the variable name and list of files for the given staging argument.
+
+    >>> _parse_stage("REFERENCE=ref.fa,ref.fa.fai")
+    ('REFERENCE', ['ref.fa', 'ref.fa.fai'])
+    """
+    name, filenames = stage.split("=", 1)
+    return name, filenames.split(",")
+
+
+def _create_job(scratch, args, pid):
+    job_id = scratch.reserve(args.name, int(args.reserve_gb * GIGABYTE), pid)
+    staged = []
+    try:
+        for stage in args.stage:
+            name, filenames = _parse_stage(stage)
+            staged.append((name, scratch.stage(job_id, filenames)))
+    except Exception:
+        scratch.release(job_id)
+        raise
+
+    return job_id, staged
+
+
+def run(args):
+    scratch = ScratchSpace(args.root)
+    job_id, staged = _create_job(scratch, args, os.getpid())
+
+    environment = os.environ.copy()
+    environment["SCRATCH_DIR"] = scratch.get_job_dir(job_id)
+    environment.update(dict(staged))
+
+    try:
+        return_code = subprocess.call(" ".join(args.command), shell=True, executable="/bin/bash", cwd=scratch.get_job_dir(job_id), env=environment)
+    finally:
+        scratch.release(job_id)
+
+    return return_code
+
+
+def create(args):
+    scratch = ScratchSpace(args.root)
+    job_id, staged = _create_job(scratch, args, args.pid)
+
+    sys.stdout.write("%s\n" % scratch.get_job_dir(job_id))
+    for name, staged_filename in staged:
+        sys.stdout.write("%s\t%s\n" % (name, staged_filename))
+
+    return 0
+
+
+def release(args):
+    ScratchSpace(args.root).release(os.path.basename(os.path.normpath(args.job_dir)))
+    return 0
+
+
+def gc(args):
+    removed = ScratchSpace(args.root).collect_garbage()
+    sys.stderr.write("Removed scratch directories of %i dead jobs\n" % removed)
+    return 0
+
+
+def _add_job_arguments(parser):
+    parser.add_argument("root", help="root directory of node-local scratch space (e.g., /var/tmp)")
+    parser.add_argument("name", help="name of the job")
+    parser.add_argument("--reserve_gb", type=float, default=0, help="scratch space in gigabytes to reserve for the job")
+    parser.add_argument("--stage", action="append", default=[], help="read-only files to share with other jobs as VARIABLE=file[,file...] where the variable is set to the staged path of the first file")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_run = subparsers.add_parser("run", help="run a command given after '--' in a scratch directory with SCRATCH_DIR and staged input variables set and remove the directory when it exits")
+    _add_job_arguments(parser_run)
+    parser_run.set_defaults(func=run)
+
+    parser_create = subparsers.add_parser("create", help="create a scratch directory owned by a process and print its path and staged inputs")
+    _add_job_arguments(parser_create)
+    parser_create.add_argument("--pid", type=int, default=os.getppid(), help="ID of the process that owns the scratch directory (default: parent process)")
+    parser_create.set_defaults(func=create)
+
+    parser_release = subparsers.add_parser("release", help="remove a scratch directory and its references to staged inputs")
+    parser_release.add_argument("root", help="root directory of node-local scratch space")
+    parser_release.add_argument("job_dir", help="scratch directory printed by the create command")
+    parser_release.set_defaults(func=release)
+
+    parser_gc = subparsers.add_parser("gc", help="remove scratch directories of jobs whose owner processes no longer exist")
+    parser_gc.add_argument("root", help="root directory of node-local scratch space")
+    parser_gc.set_defaults(func=gc)
+
+    # Split the command to run from the arguments for this script.
+    arguments = sys.argv[1:]
+    command = []
+    if "--" in arguments:
+        command = arguments[arguments.index("--") + 1:]
+        arguments = arguments[:arguments.index("--")]
+
+    args = parser.parse_args(arguments)
+    args.command = command
+    sys.exit(args.func(args))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Annotate SV sequences with RepeatMasker or TRF in parallel shards.
+
+The input FASTA is split into contiguous chunks with balanced total bases and
+each chunk is annotated by its own process with a fixed number of processes
+running at once. Outputs of all chunks are merged in the original order of
+sequences, so the merged `.out`, `.masked`, and `.trf` files list sequences in
+the same order as running the tool on the whole FASTA.
+"""
+import argparse
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import subprocess
+import sys
+
+# Number of header lines in a RepeatMasker `.out` file.
+REPEATMASKER_HEADER_LINES = 3
+
+# Line RepeatMasker writes to `.out` files when a chunk has no repeats.
+NO_REPEATS_MESSAGE = "There were no repetitive sequences detected in %s\n"
+
+
+def read_fasta_records(fasta_filename):
+    """
+    Yield the text and number of bases of each record in the given FASTA file.
+    """
+    record = []
+    bases = 0
+    with open(fasta_filename, "r") as fh:
+        for line in fh:
+            if line.startswith(">"):
+                if len(record) > 0:
+                    yield "".join(record), bases
+
+                record = []
+                bases = 0
+            else:
+                bases += len(line.strip())
+
+            record.append(line)
+
+    if len(record) > 0:
+        yield "".join(record), bases
+
+
+def get_chunk_sizes(sizes, number_of_chunks):
+    """
+    Return the number of consecutive records in each of at most the given
+    number of chunks with approximately equal total size for records of the
+    given sizes.
+
+    >>> get_chunk_sizes([10, 10, 10, 10], 2)
+    [2, 2]
+    >>> get_chunk_sizes([100, 1, 1, 1], 3)
+    [1, 3]
+    >>> get_chunk_sizes([], 4)
+    []
+    """
+    if len(sizes) == 0:
+        return []
+
+    chunk_size = max(sum(sizes) / float(number_of_chunks), 1)
+    chunks = [0]
+    current_size = 0
+    for size in sizes:
+        if current_size >= chunk_size and len(chunks) < number_of_chunks:
+            chunks.append(0)
+            current_size = 0
+
+        chunks[-1] += 1
+        current_size += size
+
+    return chunks
+
+
+def split_fasta(fasta_filename, output_dir, number_of_chunks):
+    """
+    Split the given FASTA into at most the given number of chunks with balanced
+    total bases in `{output_dir}/{chunk}/` and return the list of chunk FASTA
+    files in order.
+    """
+    sizes = [bases for record, bases in read_fasta_records(fasta_filename)]
+    chunk_sizes = get_chunk_sizes(sizes, number_of_chunks)
+    basename = os.path.basename(fasta_filename)
+
+    chunks = []
+    records = read_fasta_records(fasta_filename)
+    for chunk, chunk_records in enumerate(chunk_sizes):
+        chunk_dir = os.path.join(output_dir, str(chunk))
+        if os.path.exists(chunk_dir):
+            shutil.rmtree(chunk_dir)
+        os.makedirs(chunk_dir)
+
+        chunk_fasta = os.path.join(chunk_dir, basename)
+        with open(chunk_fasta, "w") as oh:
+            for i in range(chunk_records):
+                oh.write(next(records)[0])
+
+        chunks.append(chunk_fasta)
+
+    return chunks
+
+
+def run_commands(commands, jobs):
+    """
+    Run the given list of (command, working directory) tuples with at most the
+    given number running at once and raise CalledProcessError if any fail.
+    """
+    def run(arguments):
+        command, cwd = arguments
+        return subprocess.call(command, shell=True, cwd=cwd), command
+
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        results = pool.map(run, commands)
+    finally:
+        pool.close()
+        pool.join()
+
+    for return_code, command in results:
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command)
+
+
+def merge_repeatmasker_outputs(chunks, output_out, output_masked):
+    """
+    Merge the `.out` and `.masked` files of the given chunk FASTAs in order.
+    Chunks without repeats have no header or annotations in their `.out` file
+    and no `.masked` file, so their sequences are copied unmasked.
+    """
+    header = None
+    annotations = []
+    with open(output_masked, "w") as masked_oh:
+        for chunk in chunks:
+            with open("%s.out" % chunk, "r") as fh:
+                lines = fh.readlines()
+
+            if len(lines) > REPEATMASKER_HEADER_LINES:
+                if header is None:
+                    header = lines[:REPEATMASKER_HEADER_LINES]
+                annotations.append(lines[REPEATMASKER_HEADER_LINES:])
+
+            masked = "%s.masked" % chunk
+            if not os.path.exists(masked):
+                masked = chunk
+
+            with open(masked, "r") as fh:
+                shutil.copyfileobj(fh, masked_oh)
+
+    with open(output_out, "w") as oh:
+        if header is None:
+            oh.write(NO_REPEATS_MESSAGE % os.path.basename(output_masked).replace(".masked", ""))
+        else:
+            oh.writelines(header)
+            for lines in annotations:
+                oh.writelines(lines)
+
+
+def repeatmasker(args):
+    output_dir = os.path.abspath(args.output_dir)
+    chunks = split_fasta(args.fasta, os.path.join(output_dir, "chunks"), args.chunks)
+
+    run_commands(
+        [("RepeatMasker -species \"%s\" -dir . -xsmall -no_is -s -pa 1 %s" % (args.species, os.path.basename(chunk)), os.path.dirname(chunk))
+         for chunk in chunks],
+        args.jobs
+    )
+
+    basename = os.path.basename(args.fasta)
+    merge_repeatmasker_outputs(
+        chunks,
+        os.path.join(output_dir, "%s.out" % basename),
+        os.path.join(output_dir, "%s.masked" % basename)
+    )
+    shutil.rmtree(os.path.join(output_dir, "chunks"))
+
+    sys.stderr.write("Masked %i chunks of %s\n" % (len(chunks), args.fasta))
+    return 0
+
+
+def trf(args):
+    chunk_dir = "%s.chunks" % os.path.abspath(args.output)
+    chunks = split_fasta(args.fasta, chunk_dir, args.chunks)
+
+    trf_command = os.path.abspath(args.trf)
+    run_commands(
+        [("%s %s 2 7 7 80 10 20 500 -m -ngs -h > %s.trf" % (trf_command, os.path.basename(chunk), os.path.basename(chunk)), os.path.dirname(chunk))
+         for chunk in chunks],
+        args.jobs
+    )
+
+    with open(args.output, "w") as oh:
+        for chunk in chunks:
+            with open("%s.trf" % chunk, "r") as fh:
+                shutil.copyfileobj(fh, oh)
+
+    shutil.rmtree(chunk_dir)
+
+    sys.stderr.write("Found tandem repeats in %i chunks of %s\n" % (len(chunks), args.fasta))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_repeatmasker = subparsers.add_parser("repeatmasker", help="mask sequences with RepeatMasker in parallel chunks")
+    parser_repeatmasker.add_argument("fasta", help="FASTA of sequences to mask")
+    parser_repeatmasker.add_argument("output_dir", help="directory to write merged .out and .masked files to")
+    parser_repeatmasker.add_argument("--species", default="Homo sapiens", help="species of repeats to mask")
+    parser_repeatmasker.add_argument("--chunks", type=int, default=8, help="maximum number of chunks to split sequences into")
+    parser_repeatmasker.add_argument("--jobs", type=int, default=8, help="maximum number of chunks to mask at once")
+    parser_repeatmasker.set_defaults(func=repeatmasker)
+
+    parser_trf = subparsers.add_parser("trf", help="find tandem repeats with TRF in parallel chunks")
+    parser_trf.add_argument("fasta", help="FASTA of sequences to annotate")
+    parser_trf.add_argument("output", help="merged TRF table")
+    parser_trf.add_argument("--trf", default="trf", help="path to the TRF binary")
+    parser_trf.add_argument("--chunks", type=int, default=8, help="maximum number of chunks to split sequences into")
+    parser_trf.add_argument("--jobs", type=int, default=8, help="maximum number of chunks to annotate at once")
+    parser_trf.set_defaults(func=trf)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
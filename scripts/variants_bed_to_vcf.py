@@ -2,41 +2,195 @@
 import argparse
 import datetime
 import numpy as np
+import os
 import pandas as pd
 import pysam
 
 
-def calculate_variant_quality(variant):
-    try:
-        return int(min(100, round(-10 * np.log10(1 - (variant.contig_support / float(variant.contig_depth))) * np.log(variant.contig_depth), 0)))
-    except ZeroDivisionError:
-        return 0
+# Default number of calls to convert at once.
+DEFAULT_CHUNK_SIZE = 100000
+
+# Maximum distance between variants on a chromosome whose reference bases are
+# fetched with a single reference lookup.
+MAX_FETCH_GAP = 10000
+
+# Maximum number of reference bases fetched with a single reference lookup.
+MAX_FETCH_SPAN = 1000000
+
+VCF_COLUMNS = ("#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO")
+
+# Types of call columns. Types are set explicitly so every chunk of calls has
+# the same types regardless of its values (e.g., numeric contig names).
+CALL_COLUMN_TYPES = {
+    "chr": str,
+    "start": np.int64,
+    "end": np.int64,
+    "sv_call": str,
+    "event_size": np.int64,
+    "sv_sequence": str,
+    "contig": str,
+    "contig_start": np.int64,
+    "contig_end": np.int64,
+    "contig_support": np.int64,
+    "contig_depth": np.int64,
+    "depth": np.float64,
+    "repeat_type": str
+}
+
+
+def calculate_variant_quality(contig_support, contig_depth):
+    """
+    Return an array of variant qualities from the given arrays of supporting and
+    total local assembly depths. Qualities are capped at 100 and variants
+    without any assembly depth have a quality of zero.
+
+    >>> calculate_variant_quality([1, 2, 0, 5, 1], [2, 2, 0, 4, 20]).tolist()
+    [2, 100, 0, 100, 1]
+    """
+    support = np.asarray(contig_support, dtype=float)
+    depth = np.asarray(contig_depth, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        quality = -10 * np.log10(1 - support / depth) * np.log(depth)
+        quality = np.where(quality < 100, np.floor(quality + 0.5), 100)
+
+    return np.where(depth == 0, 0, quality).astype(int)
+
+
+def fetch_reference_bases(reference, chromosomes, positions):
+    """
+    Return a list of the uppercase reference bases at the given zero-based
+    positions on the given chromosomes. Positions are visited in sorted order
+    and nearby positions on the same chromosome share one reference lookup of
+    at most MAX_FETCH_SPAN bases.
+    """
+    bases = [""] * len(positions)
+    order = sorted(range(len(positions)), key=lambda i: (chromosomes[i], positions[i]))
+
+    first = 0
+    while first < len(order):
+        chromosome = chromosomes[order[first]]
+        last = first
+        while (last + 1 < len(order) and chromosomes[order[last + 1]] == chromosome and
+               positions[order[last + 1]] - positions[order[last]] <= MAX_FETCH_GAP and
+               positions[order[last + 1]] - positions[order[first]] < MAX_FETCH_SPAN):
+            last += 1
+
+        span_start = positions[order[first]]
+        sequence = reference.fetch(chromosome, span_start, positions[order[last]] + 1).upper()
+        for i in order[first:last + 1]:
+            offset = positions[i] - span_start
+            bases[i] = sequence[offset:offset + 1]
+
+        first = last + 1
+
+    return bases
+
+
+def _join_info(items):
+    """
+    Return a Series of INFO fields from the given list of (key, values) tuples
+    where values are lists of Python values.
+    """
+    info = None
+    for key, values in items:
+        field = pd.Series(["%s=%s" % (key, value) for value in values], dtype=object)
+        if info is None:
+            info = field
+        else:
+            info = info + ";" + field
+
+    return info
+
+
+def write_vcf_header(vcf):
+    vcf.write("##fileformat=VCFv4.2\n")
+    vcf.write("##fileDate=%s\n" % datetime.date.strftime(datetime.date.today(), "%Y%m%d"))
+    vcf.write("##source=SMRT_SV\n")
+    vcf.write('##INFO=<ID=SAMPLES,Number=1,Type=String,Description="Samples with the given variant">' + "\n")
+    vcf.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Mean depth of raw reads">' + "\n")
+    vcf.write('##INFO=<ID=CONTIG_DEPTH,Number=1,Type=Integer,Description="Total depth of local assemblies">' + "\n")
+    vcf.write('##INFO=<ID=CONTIG_SUPPORT,Number=1,Type=Integer,Description="Depth of local assemblies supporting variant">' + "\n")
+    vcf.write('##INFO=<ID=SVTYPE,Number=1,Type=String,Description="Type of structural variant">' + "\n")
+    vcf.write('##INFO=<ID=SVLEN,Number=1,Type=Integer,Description="Difference in length between REF and ALT alleles">' + "\n")
+    vcf.write('##INFO=<ID=END,Number=1,Type=Integer,Description="End coordinate of this variant">' + "\n")
+    vcf.write('##INFO=<ID=CONTIG,Number=1,Type=String,Description="Name of alternate assembly contig">' + "\n")
+    vcf.write('##INFO=<ID=CONTIG_START,Number=1,Type=Integer,Description="Start coordinate of this variant in the alternate assembly contig">' + "\n")
+    vcf.write('##INFO=<ID=CONTIG_END,Number=1,Type=Integer,Description="End coordinate of this variant in the alternate assembly contig">' + "\n")
+    vcf.write('##INFO=<ID=REPEAT_TYPE,Number=1,Type=String,Description="Repeat classification of variant content">' + "\n")
+    vcf.write('##INFO=<ID=SEQ,Number=1,Type=String,Description="Sequence associated with variant">' + "\n")
+
+
+def convert_calls_to_vcf(calls, reference, sample, variant_type):
+    """
+    Return a DataFrame of VCF columns for the given DataFrame of calls.
+    """
+    calls = calls.reset_index(drop=True)
+    columns = dict([(name, calls[name].tolist()) for name in calls.columns])
 
+    # Get the reference base at the position of the variant start.
+    reference_bases = fetch_reference_bases(reference, columns["chr"], columns["start"])
 
-def save_calls_as_vcf(vcf_filename, calls):
-    # Save genotypes as tab-delimited file.
-    with open(vcf_filename, "w") as vcf:
-        vcf.write("##fileformat=VCFv4.2\n")
-        vcf.write("##fileDate=%s\n" % datetime.date.strftime(datetime.date.today(), "%Y%m%d"))
-        vcf.write("##source=SMRT_SV\n")
-        vcf.write('##INFO=<ID=SAMPLES,Number=1,Type=String,Description="Samples with the given variant">' + "\n")
-        vcf.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Mean depth of raw reads">' + "\n")
-        vcf.write('##INFO=<ID=CONTIG_DEPTH,Number=1,Type=Integer,Description="Total depth of local assemblies">' + "\n")
-        vcf.write('##INFO=<ID=CONTIG_SUPPORT,Number=1,Type=Integer,Description="Depth of local assemblies supporting variant">' + "\n")
-        vcf.write('##INFO=<ID=SVTYPE,Number=1,Type=String,Description="Type of structural variant">' + "\n")
-        vcf.write('##INFO=<ID=SVLEN,Number=1,Type=Integer,Description="Difference in length between REF and ALT alleles">' + "\n")
-        vcf.write('##INFO=<ID=END,Number=1,Type=Integer,Description="End coordinate of this variant">' + "\n")
-        vcf.write('##INFO=<ID=CONTIG,Number=1,Type=String,Description="Name of alternate assembly contig">' + "\n")
-        vcf.write('##INFO=<ID=CONTIG_START,Number=1,Type=Integer,Description="Start coordinate of this variant in the alternate assembly contig">' + "\n")
-        vcf.write('##INFO=<ID=CONTIG_END,Number=1,Type=Integer,Description="End coordinate of this variant in the alternate assembly contig">' + "\n")
-        vcf.write('##INFO=<ID=REPEAT_TYPE,Number=1,Type=String,Description="Repeat classification of variant content">' + "\n")
-        vcf.write('##INFO=<ID=SEQ,Number=1,Type=String,Description="Sequence associated with variant">' + "\n")
-
-        if len(calls) > 0:
-            calls.to_csv(vcf, sep="\t", index=False)
-
-
-def convert_bed_to_vcf(bed_filename, reference_filename, vcf_filename, sample, variant_type):
+    # Update start position to be 1-based.
+    start = calls["start"] + 1
+    samples = [sample] * len(calls)
+
+    # Build an INFO field for each call.
+    if variant_type == "sv":
+        alt = "<" + calls["sv_call"].str[:3].str.upper() + ">"
+        info = _join_info((
+            ("END", columns["end"]),
+            ("SVTYPE", columns["sv_call"]),
+            ("SVLEN", columns["event_size"]),
+            ("CONTIG", columns["contig"]),
+            ("CONTIG_START", columns["contig_start"]),
+            ("CONTIG_END", columns["contig_end"]),
+            ("REPEAT_TYPE", columns["repeat_type"]),
+            ("CONTIG_SUPPORT", columns["contig_support"]),
+            ("CONTIG_DEPTH", columns["contig_depth"]),
+            ("SAMPLES", samples),
+            ("SEQ", columns["sv_sequence"])
+        ))
+    elif variant_type == "indel":
+        alt = "<" + calls["sv_call"].str[:3].str.upper() + ">"
+        info = _join_info((
+            ("END", columns["end"]),
+            ("SVTYPE", columns["sv_call"]),
+            ("SVLEN", columns["event_size"]),
+            ("CONTIG_SUPPORT", columns["contig_support"]),
+            ("CONTIG_DEPTH", columns["contig_depth"]),
+            ("DP", columns["depth"]),
+            ("SAMPLES", samples),
+            ("SEQ", columns["sv_sequence"])
+        ))
+    elif variant_type == "inversion":
+        alt = "<INV>"
+        info = _join_info((
+            ("END", columns["end"]),
+            ("SVTYPE", columns["sv_call"]),
+            ("SVLEN", (calls["end"] - start).tolist()),
+            ("CONTIG_SUPPORT", columns["contig_support"]),
+            ("CONTIG_DEPTH", columns["contig_depth"]),
+            ("SAMPLES", samples)
+        ))
+
+    return pd.DataFrame({
+        "#CHROM": calls["chr"],
+        "POS": start,
+        "ID": ".",
+        "REF": reference_bases,
+        "ALT": alt,
+        "QUAL": calculate_variant_quality(calls["contig_support"], calls["contig_depth"]),
+        "FILTER": "PASS",
+        "INFO": info
+    }, columns=VCF_COLUMNS)
+
+
+def convert_bed_to_vcf(bed_filename, reference_filename, vcf_filename, sample, variant_type, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Convert calls in the given BED file to VCF in chunks of the given number of
+    calls.
+    """
     # Get variants.
     if variant_type == "sv":
         columns = (0, 1, 2, 3, 4, 5, 8, 11, 12, 15, 16, 20)
@@ -51,86 +205,23 @@ def convert_bed_to_vcf(bed_filename, reference_filename, vcf_filename, sample, v
     else:
         raise Exception("Unsupported variant type: %s" % variant_type)
 
-    calls = pd.read_table(bed_filename, header=None, usecols=columns, names=names)
-
-    # Handle the special case when there are no calls.
-    if len(calls) == 0:
-        save_calls_as_vcf(vcf_filename, calls)
-        return
+    reference = pysam.FastaFile(reference_filename)
+    with open(vcf_filename, "w") as vcf:
+        write_vcf_header(vcf)
 
-    calls["sample_name"] = sample
-    calls["call_id"] = "."
-    calls["quality"] = calls.apply(calculate_variant_quality, axis=1)
-    calls["filter"] = "PASS"
+        # Calls without any lines have no chunks and are saved with the VCF
+        # header only.
+        if os.path.getsize(bed_filename) == 0:
+            return
 
-    # Get the reference base at the position of the variant start.
-    reference = pysam.FastaFile(reference_filename)
-    calls["reference"] = calls.apply(lambda row: reference.fetch(row.chr, row.start, row.start + 1).upper(), axis=1)
+        header = True
+        for calls in pd.read_table(bed_filename, header=None, usecols=columns, names=names, dtype=dict([(name, CALL_COLUMN_TYPES[name]) for name in names]), chunksize=chunk_size):
+            if len(calls) == 0:
+                continue
 
-    # Update start position to be 1-based.
-    calls["start"] = calls["start"] + 1
+            convert_calls_to_vcf(calls, reference, sample, variant_type).to_csv(vcf, sep="\t", index=False, header=header)
+            header = False
 
-    # Build an INFO field for each call.
-    if variant_type == "sv":
-        calls["alt"] = calls.apply(lambda row: "<%s>" % row.sv_call[:3].upper(), axis=1)
-        calls["info"] = calls.apply(
-            lambda row: ";".join(
-                ["=".join(map(str, item))
-                 for item in (
-                        ("END", row.end),
-                        ("SVTYPE", row.sv_call),
-                        ("SVLEN", row.event_size),
-                        ("CONTIG", row.contig),
-                        ("CONTIG_START", row.contig_start),
-                        ("CONTIG_END", row.contig_end),
-                        ("REPEAT_TYPE", row.repeat_type),
-                        ("CONTIG_SUPPORT", row.contig_support),
-                        ("CONTIG_DEPTH", row.contig_depth),
-                        ("SAMPLES", row.sample_name),
-                        ("SEQ", row.sv_sequence)
-                 )]
-            ),
-            axis=1
-        )
-    elif variant_type == "indel":
-        calls["alt"] = calls.apply(lambda row: "<%s>" % row.sv_call[:3].upper(), axis=1)
-        calls["info"] = calls.apply(
-            lambda row: ";".join(
-                ["=".join(map(str, item))
-                 for item in (
-                        ("END", row.end),
-                        ("SVTYPE", row.sv_call),
-                        ("SVLEN", row.event_size),
-                        ("CONTIG_SUPPORT", row.contig_support),
-                        ("CONTIG_DEPTH", row.contig_depth),
-                        ("DP", row.depth),
-                        ("SAMPLES", row.sample_name),
-                        ("SEQ", row.sv_sequence)
-                 )]
-            ),
-            axis=1
-        )
-    elif variant_type == "inversion":
-        calls["alt"] = "<INV>"
-        calls["info"] = calls.apply(
-            lambda row: ";".join(
-                ["=".join(map(str, item))
-                 for item in (
-                        ("END", row.end),
-                        ("SVTYPE", row.sv_call),
-                        ("SVLEN", row.end - row.start),
-                        ("CONTIG_SUPPORT", row.contig_support),
-                        ("CONTIG_DEPTH", row.contig_depth),
-                        ("SAMPLES", row.sample_name),
-                 )]
-            ),
-            axis=1
-        )
-
-    simple_calls = calls[["chr", "start", "call_id", "reference", "alt", "quality", "filter", "info"]].rename_axis({"chr": "#CHROM", "start": "POS", "reference": "REF", "call_id": "ID", "quality": "QUAL", "info": "INFO", "alt": "ALT", "filter": "FILTER"}, axis=1)
-
-    # Save calls as VCF.
-    save_calls_as_vcf(vcf_filename, simple_calls)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -139,6 +230,7 @@ if __name__ == "__main__":
     parser.add_argument("vcf", help="output VCF file of variant calls")
     parser.add_argument("sample", help="name of sample with variants")
     parser.add_argument("type", help="variant call type", choices=("sv", "indel", "inversion"))
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE, help="number of calls to convert at once")
     args = parser.parse_args()
 
-    convert_bed_to_vcf(args.bed, args.reference, args.vcf, args.sample, args.type)
+    convert_bed_to_vcf(args.bed, args.reference, args.vcf, args.sample, args.type, args.chunk_size)